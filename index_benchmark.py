@@ -0,0 +1,125 @@
+"""Compare the published recipe queries with full and partial indexes
+
+Copies the database to a temporary file and runs the queries of the
+recipe lists, title search and title suggestions there, first with the
+full indexes of schema versions 0-6 and then with the partial indexes
+of migration 7. Prints the query plan and median time of each. Run from
+the project root after seeding the database (`seed.py` publishes about
+half of the recipes):
+
+    python3 index_benchmark.py [DATABASE]
+"""
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+RUNS = 20
+
+FULL_INDEXES = """
+    DROP INDEX IF EXISTS idx_published_rating;
+    DROP INDEX IF EXISTS idx_published_title;
+    CREATE INDEX idx_published_recipes ON recipes(published);
+    CREATE INDEX idx_published_recipes_rating ON recipes(published, rating);
+    CREATE INDEX idx_recipe_title ON recipes(title COLLATE NOCASE);
+    ANALYZE;
+"""
+
+PARTIAL_INDEXES = """
+    DROP INDEX IF EXISTS idx_published_recipes;
+    DROP INDEX IF EXISTS idx_published_recipes_rating;
+    DROP INDEX IF EXISTS idx_recipe_title;
+    CREATE INDEX idx_published_rating
+    ON recipes(rating, title, rating_count, published) WHERE published = 1;
+    CREATE INDEX idx_published_title
+    ON recipes(title COLLATE NOCASE, published) WHERE published = 1;
+    ANALYZE;
+"""
+
+LIST = """
+    SELECT id, title, rating, rating_count FROM recipes
+    WHERE published = 1 {} ORDER BY rating DESC LIMIT 5 OFFSET ?
+"""
+
+COUNT = "SELECT count(*) FROM recipes WHERE published = 1 {}"
+
+SEARCH = "AND title LIKE '%kana%'"
+
+# Title suggestions before migration 7 kept the planner off the
+# published index with a unary +
+SUGGEST = """
+    SELECT title FROM recipes
+    WHERE {} AND title >= 'kana' COLLATE NOCASE
+    AND title < 'kana\U0010ffff' COLLATE NOCASE
+    GROUP BY title COLLATE NOCASE ORDER BY title COLLATE NOCASE LIMIT 10
+"""
+
+# Name: (SQL with full indexes, SQL with partial indexes, parameters)
+QUERIES = {
+    "count published": (COUNT.format(""), COUNT.format(""), []),
+    "list first page": (LIST.format(""), LIST.format(""), [0]),
+    "list page 200": (LIST.format(""), LIST.format(""), [1000]),
+    "count search": (COUNT.format(SEARCH), COUNT.format(SEARCH), []),
+    "search first page": (LIST.format(SEARCH), LIST.format(SEARCH), [0]),
+    "suggest": (
+        SUGGEST.format("+published = 1"),
+        SUGGEST.format("published = 1"),
+        [],
+    ),
+}
+
+
+def run(db: sqlite3.Connection, sql: str, params: list) -> float:
+    """Return the median time of the query in milliseconds."""
+    times = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        db.execute(sql, params).fetchall()
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+def measure(db: sqlite3.Connection) -> dict:
+    """Create each set of indexes and run the queries. Returns a dict
+    of (query name, setup) to the median time and query plan.
+    """
+    results = {}
+    for setup, script in enumerate((FULL_INDEXES, PARTIAL_INDEXES)):
+        db.executescript(script)
+        for name, (*queries, params) in QUERIES.items():
+            sql = queries[setup]
+            plan = db.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = [row[3] for row in plan]
+            results[name, setup] = (run(db, sql, params), plan)
+    return results
+
+
+def main():
+    """Copy the database and compare the two sets of indexes"""
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        "instance", "ruokareseptit.sqlite"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, "benchmark.sqlite")
+        with sqlite3.connect(source) as db:
+            db.execute("VACUUM INTO ?", [copy])
+        db.close()
+        db = sqlite3.connect(copy)
+        published, total = db.execute(
+            "SELECT SUM(published = 1), COUNT(*) FROM recipes"
+        ).fetchone()
+        print(f"{published} of {total} recipes published\n")
+        results = measure(db)
+        db.close()
+
+    for name in QUERIES:
+        print(name)
+        for setup, label in enumerate(("full", "partial")):
+            elapsed, plan = results[name, setup]
+            print(f"  {label:8} {elapsed:7.2f} ms  {'; '.join(plan)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Load test a running instance with a mix of user actions
+
+Concurrent worker threads repeat actions picked by the weights of the
+traffic mix until the duration has passed:
+
+* `browse`: view a recipe, recipes are picked by a Zipf distribution so
+  that a few recipes get most of the views
+* `list`: a page of the recipe list, also by a Zipf distribution
+* `search`: search recipes by a word
+* `login`: log in as a random `test_N` user (the server must run in
+  debug mode, as the test users have no passwords)
+* `review`: give or edit a review of a recipe, logs in first if needed
+* `edit`: change the portions of one of the user's own recipes
+
+Reports the throughput, error counts and latency percentiles of each
+action. A `database is locked` error shows as an error page in debug
+mode. Writes that the app handled show as a "failed" message on the
+page. Their cause is in the server log (eg. `SQLITE_BUSY`). Run against
+a seeded database, as reviews and recipes are changed:
+
+    flask --app ruokareseptit --debug run
+    python3 loadtest.py --workers 8 --duration 30
+"""
+import argparse
+import html
+import itertools
+import random
+import re
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from collections.abc import Sequence
+from http.cookiejar import CookieJar
+
+SEARCH_WORDS = [
+    "kana", "pasta", "peruna", "kala", "riisi", "tomaatti", "juusto",
+    "keitto", "salaatti", "pizza", "kastike", "leipä", "piirakka",
+]
+
+CSRF_RE = re.compile(r'name="csrf_token" value="([^"]*)"')
+FORM_ACTION_RE = re.compile(r'<form[^>]*action="([^"]*)"[^>]*method="post"')
+OWN_RECIPE_RE = re.compile(r'href="/my/recipes/(\d+)')
+
+ACTIONS = ("browse", "list", "search", "login", "review", "edit")
+
+
+class ActionError(Exception):
+    """Action failed, the message is the error category."""
+
+
+class Zipf:  # pylint: disable=too-few-public-methods
+    """Random items of a sequence where the item of rank k (1 for the
+    first) has weight 1 / k**s.
+    """
+
+    def __init__(self, items: Sequence, s: float):
+        self.items = items
+        self.cum_weights = list(
+            itertools.accumulate(1 / k**s for k in range(1, len(items) + 1))
+        )
+
+    def pick(self):
+        """Return a random item."""
+        return random.choices(self.items, cum_weights=self.cum_weights)[0]
+
+
+class Client:  # pylint: disable=too-few-public-methods
+    """HTTP client of one worker with its own session cookie."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar())
+        )
+        self.logged_in = False
+
+    def request(self, path: str, form: dict | None = None) -> str:
+        """Request `path`, following redirects, and return the page.
+        Raises ActionError on errors.
+        """
+        data = urllib.parse.urlencode(form).encode() if form else None
+        try:
+            with self.opener.open(self.base_url + path, data) as response:
+                page = response.read().decode()
+        except urllib.error.HTTPError as err:
+            body = err.read().decode(errors="replace")
+            if "database is locked" in body:
+                raise ActionError("database is locked") from err
+            raise ActionError(f"HTTP {err.code}") from err
+        except OSError as err:
+            raise ActionError(f"connection: {err}") from err
+        if "epäonnistui" in page:
+            raise ActionError("write failed")
+        return page
+
+
+class LoadTest:
+    """Shared settings and results of the workers."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        # Recipe ids by popularity rank, so that popular recipes are
+        # spread over the table
+        recipe_ids = list(range(1, args.recipes + 1))
+        random.Random(1).shuffle(recipe_ids)
+        self.recipes = Zipf(recipe_ids, args.zipf)
+        self.pages = Zipf(range(1, args.pages + 1), args.zipf)
+        self.mix = parse_mix(args.mix)
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = {a: [] for a in self.mix}
+        self.errors: dict[str, Counter] = {a: Counter() for a in self.mix}
+
+    def action_browse(self, client: Client):
+        """View a recipe."""
+        client.request(f"/recipes/{self.recipes.pick()}")
+
+    def action_list(self, client: Client):
+        """View a page of the recipe list."""
+        client.request(f"/recipes/?page={self.pages.pick()}")
+
+    def action_search(self, client: Client):
+        """Search recipes by a random word."""
+        query = urllib.parse.urlencode({"q": random.choice(SEARCH_WORDS)})
+        client.request(f"/recipes/search/?{query}")
+
+    def action_login(self, client: Client):
+        """Log in as a random test user."""
+        if client.logged_in:
+            # A logged in session requires the CSRF token in all forms
+            client.request("/auth/logout")
+        username = f"test_{random.randint(1, self.args.users)}"
+        page = client.request(
+            "/auth/login", {"username": username, "password": "x"}
+        )
+        if "Kirjautuminen onnistui" not in page:
+            raise ActionError("login failed (is the server in debug mode?)")
+        client.logged_in = True
+
+    def action_review(self, client: Client):
+        """Give or edit a review of a recipe."""
+        if not client.logged_in:
+            self.action_login(client)
+        page = client.request(f"/recipes/{self.recipes.pick()}/review")
+        action, token = parse_form(page)
+        client.request(
+            action,
+            {
+                "csrf_token": token,
+                "rating": random.randint(1, 5),
+                "review": random.choice(["", "Hyvää!", "Ihan ok."]),
+            },
+        )
+
+    def action_edit(self, client: Client):
+        """Change the portions of one of the user's own recipes."""
+        if not client.logged_in:
+            self.action_login(client)
+        own_recipes = OWN_RECIPE_RE.findall(client.request("/my/recipes/"))
+        if not own_recipes:
+            raise ActionError("user has no recipes")
+        page = client.request(f"/my/recipes/{random.choice(own_recipes)}")
+        action, token = parse_form(page)
+        client.request(
+            action, {"csrf_token": token, "portions": random.randint(1, 20)}
+        )
+
+    def worker(self, deadline: float):
+        """Run random actions until `deadline`."""
+        client = Client(self.args.url)
+        names = list(self.mix)
+        weights = list(self.mix.values())
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            started = time.perf_counter()
+            error = None
+            try:
+                getattr(self, "action_" + name)(client)
+            except ActionError as err:
+                error = str(err)
+            elapsed = (time.perf_counter() - started) * 1000
+            with self.lock:
+                self.latencies[name].append(elapsed)
+                if error:
+                    self.errors[name][error] += 1
+
+    def run(self) -> float:
+        """Run the workers and return the elapsed time in seconds."""
+        started = time.perf_counter()
+        deadline = started + self.args.duration
+        threads = [
+            threading.Thread(target=self.worker, args=[deadline])
+            for _ in range(self.args.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float):
+        """Print throughput, errors and latency percentiles."""
+        total = sum(len(times) for times in self.latencies.values())
+        print(
+            f"{self.args.workers} workers, {elapsed:.1f} s, {total} actions, "
+            f"{total / elapsed:.1f} actions/s\n"
+        )
+        print(
+            f"{'action':8} {'count':>7} {'/s':>7} {'errors':>7} "
+            f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        )
+        for name, times in self.latencies.items():
+            if not times:
+                continue
+            if len(times) > 1:
+                pct = statistics.quantiles(times, n=100, method="inclusive")
+            else:
+                pct = times * 99
+            errors = sum(self.errors[name].values())
+            print(
+                f"{name:8} {len(times):7} {len(times) / elapsed:7.1f} "
+                f"{errors:7} {pct[49]:8.1f} {pct[89]:8.1f} {pct[98]:8.1f} "
+                f"{max(times):8.1f}"
+            )
+        errors = sum(self.errors.values(), Counter())
+        if errors:
+            print("\nErrors:")
+            for error, count in errors.most_common():
+                print(f"  {count:7}  {error}")
+
+
+def parse_form(page: str) -> tuple[str, str]:
+    """Return the action URL and CSRF token of the form on `page`."""
+    action = FORM_ACTION_RE.search(page)
+    token = CSRF_RE.search(page)
+    if not action or not token:
+        raise ActionError("form not found")
+    return html.unescape(action.group(1)), token.group(1)
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """Parse `action=weight,...` into a dict."""
+    weights = {}
+    for item in mix.split(","):
+        name, weight = item.split("=")
+        if name not in ACTIONS:
+            raise SystemExit(f"Unknown action in mix: {name}")
+        weights[name] = float(weight)
+    return weights
+
+
+def main():
+    """Parse the arguments, run the load test and report"""
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n", maxsplit=1)[0]
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument(
+        "--mix",
+        default="browse=50,list=15,search=20,login=2,review=8,edit=5",
+        help="weights of the actions",
+    )
+    parser.add_argument(
+        "--recipes", type=int, default=50000, help="largest recipe id"
+    )
+    parser.add_argument(
+        "--pages", type=int, default=1000, help="list pages to browse"
+    )
+    parser.add_argument(
+        "--users", type=int, default=10000, help="number of test_N users"
+    )
+    parser.add_argument(
+        "--zipf", type=float, default=1.1, help="Zipf exponent"
+    )
+    load_test = LoadTest(parser.parse_args())
+    load_test.report(load_test.run())
+
+
+if __name__ == "__main__":
+    main()
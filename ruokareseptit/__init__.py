@@ -3,7 +3,9 @@
 import os
 from flask import Flask
 
-from .model import auth, db, navigation
+from . import cli
+from .model import archive, auth, cache, db, maintenance, metrics
+from .model import navigation, profiling, responses, templating
 
 
 def create_app():
@@ -12,6 +14,9 @@ def create_app():
     app.config.from_mapping(
         SECRET_KEY="dev",  # used for signing the session cookie
         DATABASE=os.path.join(app.instance_path, "ruokareseptit.sqlite"),
+        ARCHIVE_DATABASE=os.path.join(
+            app.instance_path, "ruokareseptit-archive.sqlite"
+        ),
     )
     app.config.from_object("ruokareseptit.default_settings")
     app.config.from_pyfile("config.py", silent=True)
@@ -22,6 +27,14 @@ def create_app():
         pass
 
     db.init_app(app)
+    archive.init_app(app)
+    maintenance.init_app(app)
+    metrics.init_app(app)
+    profiling.init_app(app)
+    cache.init_app(app)
+    templating.init_app(app)
+    responses.init_app(app)
+    cli.register_commands(app)
     auth.register_before_request(app)
     navigation.register_context_processor(app)
 
@@ -0,0 +1,170 @@
+"""Preforking server: `python -m ruokareseptit`
+
+The application is created and warmed up once in the parent process,
+then `SERVER_WORKERS` worker processes are forked to serve requests from
+a shared listening socket. Workers share the loaded modules, compiled
+templates and warmed caches of the parent copy-on-write. A worker that
+exits is replaced with a new one.
+
+Each worker runs werkzeug's WSGI server with a fixed pool of
+`SERVER_THREADS` request threads. A worker accepts a connection only
+when a thread is free, so excess connections wait in the listen backlog
+instead of all being served at once. The server has no request
+timeouts or buffering of slow clients, so it should be run behind a
+reverse proxy.
+"""
+
+import gc
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import Flask
+from werkzeug.serving import BaseWSGIServer
+from werkzeug.serving import WSGIRequestHandler
+
+from ruokareseptit import create_app
+from ruokareseptit.model.db import get_db
+from ruokareseptit.model.metrics import clear_metrics
+from ruokareseptit.model.recipes import category_ids, list_top_recipe_ids
+from ruokareseptit.model.templating import precompile_templates
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def warm_up(app: Flask):
+    """Compile templates, load the category cache, read the database
+    files to the OS page cache and request each of `WARMUP_URLS` and the
+    pages of the `WARMUP_TOP_RECIPES` best rated recipes once.
+    """
+    with app.app_context():
+        precompile_templates()
+        top_ids = list_top_recipe_ids(
+            get_db(), app.config["WARMUP_TOP_RECIPES"]
+        )
+        category_ids(get_db())
+    for suffix in ("", "-wal"):
+        try:
+            with open(app.config["DATABASE"] + suffix, "rb") as f:
+                while f.read(READ_CHUNK_SIZE):
+                    pass
+        except FileNotFoundError:
+            pass
+    client = app.test_client()
+    urls = [*app.config["WARMUP_URLS"]]
+    urls += [f"/recipes/{recipe_id}" for recipe_id in top_ids]
+    for url in urls:
+        started = time.perf_counter()
+        response = client.get(url)
+        response.get_data()
+        elapsed = (time.perf_counter() - started) * 1000
+        click.echo(f"Warmup {url} {response.status_code} {elapsed:.1f} ms")
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Closes the connection after each response, so that an idle
+    keep-alive connection does not hold a request thread.
+    """
+
+    protocol_version = "HTTP/1.0"
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server that handles requests on a pool of `threads`
+    threads. The next connection is accepted only when a thread is
+    free.
+    """
+
+    multithread = True
+
+    def __init__(self, app: Flask, sock: socket.socket, threads: int):
+        host, port = sock.getsockname()[:2]
+        super().__init__(host, port, app, RequestHandler, fd=sock.fileno())
+        self.slots = threading.BoundedSemaphore(threads)
+        self.pool = ThreadPoolExecutor(threads, "request")
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()  # pylint: disable=consider-using-with
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        """Handle one connection in a pool thread."""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+
+def serve(app: Flask, sock: socket.socket):
+    """Serve requests from the listening socket until terminated."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = PooledWSGIServer(app, sock, app.config["SERVER_THREADS"])
+    server.serve_forever()
+
+
+def spawn_worker(app: Flask, sock: socket.socket) -> int:
+    """Fork a worker process and return its pid."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            serve(app, sock)
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+    return pid
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8000, show_default=True)
+@click.option("--workers", type=int, help="Default: SERVER_WORKERS.")
+def main(host: str, port: int, workers: int | None):
+    """Run the application with preloaded worker processes."""
+    app = create_app()
+    workers = workers or app.config["SERVER_WORKERS"]
+    warm_up(app)
+    clear_metrics(app)
+
+    sock = socket.create_server((host, port), backlog=128)
+    sock.set_inheritable(True)
+    if not hasattr(os, "fork"):
+        serve(app, sock)
+        return
+
+    # Objects created so far are never freed, so keep the collector
+    # from touching (and copying) their memory pages in the workers
+    gc.collect()
+    gc.freeze()
+
+    stopping = False
+
+    def stop(signum, _):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signum)
+
+    children = {spawn_worker(app, sock) for _ in range(workers)}
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    click.echo(f"Serving on http://{host}:{port} with {workers} workers")
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            click.echo(f"Worker {pid} exited, starting a new one")
+            children.add(spawn_worker(app, sock))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -12,9 +12,10 @@ from ruokareseptit.model.db import get_db, log_db_error
 from ruokareseptit.model.auth import login_required
 from ruokareseptit.model.reviews import list_user_reviews
 from ruokareseptit.model.reviews import fetch_author_review_context
-from ruokareseptit.model.recipes import fetch_published_recipe_context
 from ruokareseptit.model.reviews import update_author_review
 from ruokareseptit.model.reviews import delete_author_review
+from ruokareseptit.model.templating import recipe_page_context
+from ruokareseptit.model.templating import stream_page
 
 
 bp = Blueprint(
@@ -30,7 +31,10 @@ def index(review_id: int):
     if not review_id:
         with get_db() as db:
             page = int(request.args.get("page", 0))
-            rows, count, pages = list_user_reviews(db, g.user["id"], page)
+            archived = request.args.get("archived")
+            rows, count, pages = list_user_reviews(
+                db, g.user["id"], page, archived == "1"
+            )
             page = max(min(pages, page), 1)
             context = {
                 "reviews": rows,
@@ -39,12 +43,12 @@ def index(review_id: int):
                 "total_pages": pages,
             }
             if page < pages:
-                next_p = url_for(".index", page=page + 1)
+                next_p = url_for(".index", page=page + 1, archived=archived)
                 context["next_page"] = next_p
             if page > 1:
-                prev_p = url_for(".index", page=page - 1)
+                prev_p = url_for(".index", page=page - 1, archived=archived)
                 context["prev_page"] = prev_p
-            return render_template("my/reviews/list.html", **context)
+            return stream_page("my/reviews/list.html", **context)
 
     with get_db() as db:
         review_context = fetch_author_review_context(
@@ -54,7 +58,7 @@ def index(review_id: int):
             return redirect(url_for(".index"))
 
         recipe_id = review_context["review"]["recipe_id"]
-        recipe_context = fetch_published_recipe_context(db, recipe_id)
+        recipe_context = recipe_page_context(db, recipe_id)
         if recipe_context:
             review_context = {**review_context, **recipe_context}
 
@@ -8,11 +8,14 @@ from flask import request
 from flask import g
 from flask import flash
 
+from ruokareseptit.model.archive import has_archived_review
 from ruokareseptit.model.db import get_db, log_db_error
 from ruokareseptit.model.auth import login_required
 from ruokareseptit.model.recipes import list_published_recipes
-from ruokareseptit.model.recipes import fetch_published_recipe_context
+from ruokareseptit.model.reviews import fetch_author_review_id
 from ruokareseptit.model.reviews import insert_review
+from ruokareseptit.model.templating import recipe_page_context
+from ruokareseptit.model.templating import stream_page
 
 bp = Blueprint("browse", __name__, url_prefix="/", template_folder="templates")
 
@@ -41,10 +44,22 @@ def index(recipe_id: int):
             return render_template("recipes/browse/list.html", **context)
 
     with get_db() as db:
-        recipe_context = fetch_published_recipe_context(db, recipe_id)
+        archived = request.args.get("archived") == "1"
+        recipe_context = recipe_page_context(
+            db, recipe_id, archived
+        )
         if recipe_context is None:
             return redirect(url_for(".index"))
-        return render_template("recipes/browse/view.html", **recipe_context)
+        if g.user:
+            own_review_id = fetch_author_review_id(
+                db, recipe_id, g.user["id"]
+            )
+            recipe_context["own_review_id"] = own_review_id
+            recipe_context["own_review_archived"] = (
+                own_review_id is None
+                and has_archived_review(db, recipe_id, g.user["id"])
+            )
+        return stream_page("recipes/browse/view.html", **recipe_context)
 
 
 @bp.route("/<int:recipe_id>/review")
@@ -53,8 +68,7 @@ def review(recipe_id: int):
     """Add user review to a recipe"""
     try:
         with get_db() as db:
-            cursor = insert_review(db, g.user["id"], recipe_id)
-            review_id = cursor.lastrowid
+            review_id = insert_review(db, g.user["id"], recipe_id)
     except db.Error as err:
         log_db_error(err)
         flash("Arvostelun luominen epäonnistui.")
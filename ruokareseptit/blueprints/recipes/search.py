@@ -1,12 +1,15 @@
 """Search recipes"""
 
 from flask import Blueprint
+from flask import current_app
+from flask import jsonify
 from flask import render_template
 from flask import url_for
 from flask import request
 
 from ruokareseptit.model.db import get_db
 from ruokareseptit.model.recipes import search_recipes_title
+from ruokareseptit.model.recipes import suggest_recipe_titles
 
 bp = Blueprint(
     "search", __name__, url_prefix="/search", template_folder="templates"
@@ -38,3 +41,18 @@ def index():
             return render_template("recipes/search/search.html", **context)
     context = {}
     return render_template("recipes/search/search.html", **context)
+
+
+@bp.route("/suggest")
+def suggest():
+    """Titles and category names starting with the search term as JSON"""
+    prefix = request.args.get("q", "").lstrip()
+    titles, categories = [], []
+    if prefix:
+        limit = current_app.config["SEARCH_SUGGEST_LIMIT"]
+        with get_db() as db:
+            titles, categories = suggest_recipe_titles(db, prefix, limit)
+    response = jsonify({"titles": titles, "categories": categories})
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config["SEARCH_CACHE_TTL"]
+    return response
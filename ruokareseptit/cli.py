@@ -0,0 +1,55 @@
+"""CLI commands that are imported only when they are run"""
+
+import importlib
+import click
+
+# Command name: (module, command, short help). The short help is shown
+# in `flask --help` without importing the module.
+COMMANDS = {
+    "archive-reviews": (
+        "ruokareseptit.model.archive",
+        "archive_reviews_command",
+        "Move old rating-only reviews to the archive database.",
+    ),
+    "backup": (
+        "ruokareseptit.model.backup",
+        "backup_command",
+        "Back up the database while the app is running.",
+    ),
+    "maintenance": (
+        "ruokareseptit.model.maintenance",
+        "maintenance_command",
+        "Analyze the database and vacuum free pages.",
+    ),
+    "similar-recipes": (
+        "ruokareseptit.model.similar",
+        "similar_recipes_command",
+        "Compute similar recipes of every published recipe.",
+    ),
+}
+
+
+class LazyCommand(click.Command):
+    """Placeholder of a command that imports the module of the command
+    when it is run, or its help is shown.
+    """
+
+    def __init__(self, name: str, module: str, command: str, short_help):
+        super().__init__(name, short_help=short_help)
+        self.module = module
+        self.command = command
+
+    def load(self) -> click.Command:
+        """Import and return the command."""
+        return getattr(importlib.import_module(self.module), self.command)
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        return self.load().make_context(info_name, args, parent, **extra)
+
+
+def register_commands(app):
+    """Register the CLI commands. This is called by the application
+    factory.
+    """
+    for name, (module, command, short_help) in COMMANDS.items():
+        app.cli.add_command(LazyCommand(name, module, command, short_help))
@@ -4,5 +4,31 @@ RECIPE_INGREDIENTS_MAX = 20
 RECIPE_INSTRUCTIONS_MAX = 20
 RECIPE_CATEGORIES_MAX = 20
 RECIPE_USER_REVIEWS_MAX = 1000
+SIMILAR_RECIPES_MAX = 5
 RECIPE_LIST_PAGE_SIZE = 5
 REVIEW_LIST_PAGE_SIZE = 5
+USER_CACHE_TTL = 60
+COMPRESS_LEVEL = 6
+COMPRESS_MIN_SIZE = 1024
+MIGRATION_CHUNK_SIZE = 1000
+SEARCH_CACHE_SIZE = 1000
+SEARCH_CACHE_TTL = 60
+SEARCH_SUGGEST_LIMIT = 10
+FRAGMENT_CACHE_SIZE = 1000
+FRAGMENT_CACHE_TTL = 3600
+DB_READ_POOL_SIZE = 0
+SERVER_WORKERS = 2
+SERVER_THREADS = 8
+WARMUP_URLS = ["/recipes/", "/recipes/?page=2"]
+WARMUP_TOP_RECIPES = 10
+ARCHIVE_AFTER_DAYS = 365
+DB_CACHE_SIZE = -2000
+MAINTENANCE_WRITES = 1000
+MAINTENANCE_INTERVAL = 3600
+ANALYSIS_LIMIT = 1000
+METRICS_FLUSH_INTERVAL = 5
+METRICS_ALLOWED_ADDRESSES = ["127.0.0.1", "::1"]
+PROFILE_TOKEN = None
+PROFILE_SAMPLE_RATE = 0
+PROFILE_SLOW_SECONDS = 0
+PROFILE_INTERVAL = 0.005
@@ -0,0 +1,283 @@
+"""Archive of old rating-only reviews
+
+`flask archive-reviews` moves reviews that have a rating but no text and
+are older than `ARCHIVE_AFTER_DAYS` from `user_reviews` to the same
+table in a separate archive database (`ARCHIVE_DATABASE`). This keeps
+the hot table and its indexes small. The ratings stay in the rating
+aggregates of the recipes.
+
+Queries read the archive only when asked: `reviews_source` returns a
+FROM clause which unions the archive to the hot table when it is
+attached. An archived review can not be edited. When the user reviews
+the recipe again, the archived review is moved back to the hot table
+(`restore_review`) and the user edits it, so there is still only one
+review per user and recipe.
+"""
+
+import os
+import sqlite3
+import time
+import click
+from flask import current_app
+
+from ruokareseptit.model.db import get_db
+
+REVIEW_COLUMNS = (
+    "id, author_id, recipe_id, rating, review, created_at, updated_at"
+)
+
+# Reviews that are moved to the archive, with the cut-off time `:before`
+ARCHIVE_CONDITION = """
+    review IS NULL AND rating IS NOT NULL
+    AND IFNULL(updated_at, '') < :before
+"""
+
+
+def init_app(app):
+    """Register the template helper. This is called by the application
+    factory.
+    """
+    app.context_processor(lambda: {"archive_exists": archive_exists})
+
+
+def archive_exists() -> bool:
+    """Return True if reviews have been archived."""
+    return os.path.exists(current_app.config["ARCHIVE_DATABASE"])
+
+
+def attach_archive(db: sqlite3.Connection, create: bool = False) -> bool:
+    """Attach the archive database as `archive` to `db` unless already
+    attached. Returns False if there is no archive, unless `create` is
+    true.
+    """
+    attached = db.execute(
+        "SELECT 1 FROM pragma_database_list WHERE name = 'archive'"
+    ).fetchone()
+    if attached:
+        return True
+    if not create and not archive_exists():
+        return False
+    path = current_app.config["ARCHIVE_DATABASE"]
+    db.execute("ATTACH DATABASE ? AS archive", [path])
+    return True
+
+
+def reviews_source(db: sqlite3.Connection, archived: bool) -> str:
+    """Return a FROM clause subquery named `user_reviews`, with the
+    extra column `archived`. If `archived` is true and there is an archive,
+    archived reviews are included.
+    """
+    hot = (
+        f"SELECT {REVIEW_COLUMNS}, author_username, 0 AS archived "
+        "FROM main.user_reviews"
+    )
+    if archived and attach_archive(db):
+        # The username triggers keep only the hot table in sync, so the
+        # authors of archived reviews are looked up
+        cold = (
+            f"SELECT {REVIEW_COLUMNS}, (SELECT username FROM main.users "
+            "WHERE users.id = author_id) AS author_username, 1 AS archived "
+            "FROM archive.user_reviews"
+        )
+        return f"({hot} UNION ALL {cold}) AS user_reviews"
+    return f"({hot}) AS user_reviews"
+
+
+def create_archive(db: sqlite3.Connection):
+    """Create the archive table in the attached archive database."""
+    db.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS archive.user_reviews (
+            id INTEGER PRIMARY KEY,
+            author_id INTEGER,
+            recipe_id INTEGER,
+            rating INTEGER,
+            review TEXT,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS archive.idx_archived_recipe_reviews
+        ON user_reviews(recipe_id);
+        CREATE INDEX IF NOT EXISTS archive.idx_archived_author_reviews
+        ON user_reviews(author_id, rating, created_at, id);
+        """
+    )
+
+
+def archive_reviews(
+    db: sqlite3.Connection, days: int, chunk_size: int = 1000, echo=print
+) -> int:
+    """Move rating-only reviews older than `days` to the archive in
+    chunks of `chunk_size` ids. Returns the number of archived reviews.
+    """
+    attach_archive(db, create=True)
+    create_archive(db)
+    # Reviews from before the timestamps were added have NULL times
+    before = db.execute(
+        "SELECT datetime('now', ?)", [f"-{int(days)} days"]
+    ).fetchone()[0]
+    max_id = db.execute(
+        "SELECT IFNULL(MAX(id), 0) FROM main.user_reviews"
+    ).fetchone()[0]
+    db.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS moving (id INTEGER PRIMARY KEY)"
+    )
+    archived = 0
+    for start in range(0, max_id, chunk_size):
+        chunk = {"start": start, "end": start + chunk_size, "before": before}
+        with db:
+            db.execute("DELETE FROM temp.moving")
+            db.execute(
+                f"""
+                INSERT INTO temp.moving
+                SELECT id FROM main.user_reviews
+                WHERE id > :start AND id <= :end AND {ARCHIVE_CONDITION}
+                """,
+                chunk,
+            )
+            db.execute(
+                f"""
+                INSERT OR REPLACE INTO archive.user_reviews
+                ({REVIEW_COLUMNS})
+                SELECT {REVIEW_COLUMNS} FROM main.user_reviews
+                WHERE id IN temp.moving
+                """
+            )
+        # Commits to the two databases are not atomic together, so the
+        # copy is committed first. If interrupted here, the rows are
+        # still in the hot table and are moved again on the next run.
+        with db:
+            # The write lock keeps the rows from changing until deleted
+            db.execute("BEGIN IMMEDIATE")
+            # Rows edited or deleted since they were copied are not
+            # moved, and their copies are removed from the archive
+            for table in ("archive.user_reviews", "temp.moving"):
+                db.execute(
+                    f"""
+                    DELETE FROM {table}
+                    WHERE id IN temp.moving AND id NOT IN (
+                        SELECT id FROM main.user_reviews
+                        WHERE id IN temp.moving AND {ARCHIVE_CONDITION}
+                    )
+                    """,
+                    chunk,
+                )
+            # Copies left by a restore whose archive commit was lost
+            db.execute(
+                """
+                DELETE FROM archive.user_reviews
+                WHERE id > :start AND id <= :end AND id NOT IN temp.moving
+                AND id IN (SELECT id FROM main.user_reviews)
+                """,
+                chunk,
+            )
+            # The rating triggers subtract the deleted ratings from the
+            # aggregates, so they are added back first
+            db.execute(
+                f"""
+                UPDATE recipes
+                SET rating_sum = rating_sum + moved.sum,
+                rating_count = rating_count + moved.count
+                FROM (
+                    SELECT recipe_id, SUM(rating) AS sum,
+                    COUNT(rating) AS count
+                    FROM main.user_reviews
+                    WHERE id IN temp.moving AND {ARCHIVE_CONDITION}
+                    GROUP BY recipe_id
+                ) AS moved
+                WHERE recipes.id = moved.recipe_id
+                """,
+                chunk,
+            )
+            cursor = db.execute(
+                f"""
+                DELETE FROM main.user_reviews
+                WHERE id IN temp.moving AND {ARCHIVE_CONDITION}
+                """,
+                chunk,
+            )
+        archived += cursor.rowcount
+        echo(f"  {min(start + chunk_size, max_id)}/{max_id}")
+    return archived
+
+
+def has_archived_review(
+    db: sqlite3.Connection, recipe_id: int, author_id: int
+) -> bool:
+    """Return True if the review of user `author_id` for `recipe_id`
+    has been archived.
+    """
+    if not attach_archive(db):
+        return False
+    row = db.execute(
+        """
+        SELECT 1 FROM archive.user_reviews
+        WHERE author_id = ? AND recipe_id = ?
+        """,
+        [author_id, recipe_id],
+    ).fetchone()
+    return row is not None
+
+
+def restore_review(db: sqlite3.Connection, author_id: int, recipe_id: int):
+    """Move the archived review of user `author_id` for `recipe_id`
+    back to the hot table, unless the user has a review there. Returns
+    True if a review was restored.
+    """
+    if not attach_archive(db):
+        return False
+    row = db.execute(
+        """
+        SELECT id, rating, created_at FROM archive.user_reviews
+        WHERE author_id = :author_id AND recipe_id = :recipe_id
+        AND NOT EXISTS (
+            SELECT 1 FROM main.user_reviews
+            WHERE author_id = :author_id AND recipe_id = :recipe_id
+        )
+        """,
+        {"author_id": author_id, "recipe_id": recipe_id},
+    ).fetchone()
+    if row is None:
+        return False
+    review_id, rating, created_at = row
+    # The aggregates include the archived rating, and the rating
+    # trigger adds it again when the review is inserted
+    db.execute(
+        """
+        UPDATE recipes
+        SET rating_sum = rating_sum - ?, rating_count = rating_count - 1
+        WHERE id = ?
+        """,
+        [rating, recipe_id],
+    )
+    db.execute(
+        f"""
+        INSERT INTO main.user_reviews ({REVIEW_COLUMNS})
+        SELECT {REVIEW_COLUMNS} FROM archive.user_reviews WHERE id = ?
+        """,
+        [review_id],
+    )
+    # The insert trigger sets the creation time to now
+    db.execute(
+        "UPDATE main.user_reviews SET created_at = ? WHERE id = ?",
+        [created_at, review_id],
+    )
+    # The databases commit separately. If the delete is lost, the next
+    # archive run removes the copy, as the review is in the hot table.
+    db.execute("DELETE FROM archive.user_reviews WHERE id = ?", [review_id])
+    return True
+
+
+@click.command("archive-reviews")
+@click.option("--days", type=int, help="Default: ARCHIVE_AFTER_DAYS.")
+def archive_reviews_command(days: int | None):
+    """Move old rating-only reviews to the archive database."""
+    started = time.perf_counter()
+    if days is None:
+        days = current_app.config["ARCHIVE_AFTER_DAYS"]
+    chunk_size = current_app.config["MIGRATION_CHUNK_SIZE"]
+    archived = archive_reviews(get_db(), days, chunk_size, click.echo)
+    click.echo(
+        f"Archived {archived} reviews "
+        f"in {time.perf_counter() - started:.1f} s."
+    )
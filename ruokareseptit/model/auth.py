@@ -14,6 +14,7 @@ from werkzeug.security import generate_password_hash
 from werkzeug.security import check_password_hash
 
 from ruokareseptit.model.db import get_db
+from ruokareseptit.model.cache import TTLCache
 
 
 def login_required(view):
@@ -32,30 +33,30 @@ def login_required(view):
 
 def register_before_request(app):
     """Register before request action"""
+    app.extensions["user_cache"] = TTLCache(app.config["USER_CACHE_TTL"])
 
     @app.before_request
     def g_user():
         """Set g.user if logged in. Clear session if user
-        has been deleted from db.
+        has been deleted from db. Users found in the db are
+        cached for `USER_CACHE_TTL` seconds in each worker process,
+        keyed by `users_version`, so a deleted or renamed user is not
+        read from the cache anymore.
         """
+        g.user = None
         uid = session.get("uid")
         if uid:
-            user_in_db = (
-                get_db()
-                .execute(
-                    """
-                SELECT id, username
-                FROM users
-                WHERE id = ?
-                """,
-                    [uid],
-                )
-                .fetchone()
-            )
-            if user_in_db:
-                g.user = user_in_db
+            db = get_db()
+            user_cache = current_app.extensions["user_cache"]
+            key = (uid, users_version(db))
+            user = user_cache.get(key)
+            if user is None:
+                user = fetch_user(db, uid)
+                if user:
+                    user_cache.set(key, user)
+            if user:
+                g.user = user
                 return
-            g.user = None
             session.clear()
 
     @app.before_request
@@ -70,6 +71,29 @@ def register_before_request(app):
 # SQL queries for READ operations ########################################
 
 
+def users_version(db: Cursor) -> int:
+    """Version of the users. Triggers bump it in the same transaction
+    as every delete or rename of a user, so it is shared by all worker
+    processes.
+    """
+    return db.execute("SELECT version FROM users_version").fetchone()[0]
+
+
+def fetch_user(db: Cursor, uid: int) -> dict[str, any] | None:
+    """Return `id` and `username` of user `uid`."""
+    user = db.execute(
+        """
+        SELECT id, username
+        FROM users
+        WHERE id = ?
+        """,
+        [uid],
+    ).fetchone()
+    if user:
+        return {"id": user["id"], "username": user["username"]}
+    return None
+
+
 def auth_user_id(db: Cursor, username: str, password: str) -> int | None:
     """Return user id for username if password is correct."""
     user: dict[str, any] = db.execute(
@@ -0,0 +1,134 @@
+"""Online backups of the database
+
+`flask backup` copies the database (and the review archive, if any) to
+timestamped files under `instance/backups` while the app is running.
+By default the SQLite backup API copies `--pages` pages at a time and
+sleeps `--sleep` seconds in between, so that requests are not starved.
+With `--vacuum-into` the copy is a compacted snapshot made with
+`VACUUM INTO` instead. Every copy is verified with
+`PRAGMA integrity_check` and can be compressed with gzip.
+"""
+
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+import click
+from flask import current_app
+
+
+class Timer:
+    """Context manager echoing the duration of a step."""
+
+    def __init__(self, step: str, echo):
+        self.step = step
+        self.echo = echo
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        elapsed = time.perf_counter() - self.started
+        self.echo(f"  {self.step}: {elapsed:.2f} s")
+
+
+def backup_database(
+    source: str, target: str, pages: int, sleep: float, echo=print
+):
+    """Copy `source` to `target` with the backup API, `pages` pages at
+    a time, sleeping `sleep` seconds after every step. The source is
+    not locked during the sleep.
+    """
+
+    def progress(_, remaining, total):
+        echo(f"    {total - remaining}/{total} pages")
+        # Connection.backup sleeps only when a step is busy or locked
+        if remaining:
+            time.sleep(sleep)
+
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+    src.close()
+    dst.close()
+
+
+def vacuum_into_file(source: str, target: str):
+    """Write a compacted copy of `source` to `target`."""
+    with sqlite3.connect(source) as src:
+        src.execute("VACUUM INTO ?", [target])
+    src.close()
+
+
+def verify(path: str):
+    """Raise ClickException if `path` fails the integrity check."""
+    with sqlite3.connect(path) as db:
+        result = db.execute("PRAGMA integrity_check").fetchall()
+    db.close()
+    if result != [("ok",)]:
+        problems = "; ".join(row[0] for row in result[:10])
+        raise click.ClickException(f"{path} is corrupt: {problems}")
+
+
+def compress(path: str) -> str:
+    """Gzip `path` and remove the uncompressed file. Returns the path
+    of the compressed file.
+    """
+    with open(path, "rb") as src, gzip.open(path + ".gz", "wb", 6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.remove(path)
+    return path + ".gz"
+
+
+@click.command("backup")
+@click.option(
+    "--vacuum-into", is_flag=True, help="Make a compacted snapshot."
+)
+@click.option("--gzip", "use_gzip", is_flag=True, help="Compress the copy.")
+@click.option(
+    "--pages",
+    default=1024,
+    show_default=True,
+    help="Pages copied at a time by the backup API.",
+)
+@click.option(
+    "--sleep",
+    default=0.01,
+    show_default=True,
+    help="Seconds to sleep between the page steps.",
+)
+def backup_command(
+    vacuum_into: bool, use_gzip: bool, pages: int, sleep: float
+):
+    """Back up the database while the app is running."""
+    backup_dir = os.path.join(current_app.instance_path, "backups")
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    databases = [current_app.config["DATABASE"]]
+    if os.path.exists(current_app.config["ARCHIVE_DATABASE"]):
+        databases.append(current_app.config["ARCHIVE_DATABASE"])
+
+    started = time.perf_counter()
+    for source in databases:
+        name, ext = os.path.splitext(os.path.basename(source))
+        target = os.path.join(backup_dir, f"{name}-{stamp}{ext}")
+        if os.path.exists(target) or os.path.exists(target + ".gz"):
+            raise click.ClickException(f"{target} already exists")
+        click.echo(f"{source} -> {target}")
+        if vacuum_into:
+            with Timer("vacuum into", click.echo):
+                vacuum_into_file(source, target)
+        else:
+            with Timer("backup", click.echo):
+                backup_database(source, target, pages, sleep, click.echo)
+        with Timer("integrity check", click.echo):
+            verify(target)
+        if use_gzip:
+            with Timer("gzip", click.echo):
+                target = compress(target)
+        size = os.path.getsize(target) / 1024 / 1024
+        click.echo(f"  {target}: {size:.1f} MiB")
+    click.echo(f"Backup done in {time.perf_counter() - started:.1f} s.")
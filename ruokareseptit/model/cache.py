@@ -0,0 +1,83 @@
+"""In-process caches"""
+
+import threading
+import time
+from sqlite3 import Connection
+
+
+class TTLCache:
+    """Thread safe mapping where each entry expires `ttl` seconds
+    after it was stored. When `maxsize` is reached the least recently
+    used entry is dropped. Expired or missing keys return `default`.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return cached value or `default` if missing or expired."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return default
+            self._data[key] = entry  # most recently used is last
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Store `value`, replacing any previous entry of `key`."""
+        with self._lock:
+            self._data.pop(key, None)
+            if len(self._data) >= self.maxsize:
+                del self._data[next(iter(self._data))]
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def pop(self, key):
+        """Invalidate `key`."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Invalidate all entries."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """Return number of entries, hits, misses and hit ratio."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def init_app(app):
+    """Create the shared query result and rendered fragment caches.
+    This is called by the application factory.
+    """
+    app.extensions["search_cache"] = TTLCache(
+        app.config["SEARCH_CACHE_TTL"], app.config["SEARCH_CACHE_SIZE"]
+    )
+    app.extensions["fragment_cache"] = TTLCache(
+        app.config["FRAGMENT_CACHE_TTL"], app.config["FRAGMENT_CACHE_SIZE"]
+    )
+
+
+def data_version(db: Connection) -> int:
+    """Version of the published data. Triggers bump it in the same
+    transaction as every write that changes search results or their
+    order, so it is shared by all worker processes. Cached query
+    results are keyed by the version, which must be read before the
+    results: results read after a concurrent write are then only
+    cached under the older version, which is not used anymore.
+    """
+    return db.execute("SELECT version FROM data_version").fetchone()[0]
@@ -1,11 +1,17 @@
 """Database connection and utilities"""
 
+import os
+import pathlib
 import sqlite3
+import threading
+import time
 from datetime import datetime
 import click
 from flask import current_app
 from flask import g
 
+from ruokareseptit.model.metrics import TimedConnection, count, record_db_time
+
 
 def get_db():
     """Connect to the application's configured database. The connection
@@ -16,15 +22,91 @@ def get_db():
         g.db = sqlite3.connect(
             current_app.config["DATABASE"],
             detect_types=sqlite3.PARSE_DECLTYPES,
+            factory=TimedConnection,
         )
+        count("db_connections")
         if current_app.debug:
             g.db.set_trace_callback(print)
         g.db.execute("PRAGMA foreign_keys = ON")
+        cache_size = int(current_app.config["DB_CACHE_SIZE"])
+        g.db.execute(f"PRAGMA cache_size = {cache_size}")
         g.db.row_factory = sqlite3.Row
 
     return g.db
 
 
+def get_read_pool():
+    """Return the read query thread pool of this process, or None if
+    `DB_READ_POOL_SIZE` is 0. The pool is created on first use, so each
+    worker process gets its own threads after forking.
+    """
+    size = current_app.config["DB_READ_POOL_SIZE"]
+    if not size:
+        return None
+    pools = current_app.extensions.setdefault("db_read_pools", {})
+    pid = os.getpid()
+    if pid not in pools:
+        # pylint: disable=import-outside-toplevel
+        from concurrent.futures import ThreadPoolExecutor
+
+        pools.clear()
+        uri = pathlib.Path(current_app.config["DATABASE"]).resolve().as_uri()
+        pools[pid] = ThreadPoolExecutor(
+            size,
+            thread_name_prefix="db-read",
+            initializer=connect_read_only,
+            initargs=[uri + "?mode=ro"],
+        )
+    return pools[pid]
+
+
+read_local = threading.local()
+
+
+def connect_read_only(uri: str):
+    """Open the read only connection of a read pool thread."""
+    read_local.db = sqlite3.connect(
+        uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES
+    )
+    read_local.db.row_factory = sqlite3.Row
+
+
+def fetch_all(sql: str, parameters):
+    """Execute a query on the connection of the current read pool
+    thread and return all rows.
+    """
+    return read_local.db.execute(sql, parameters).fetchall()
+
+
+def read_many(db: sqlite3.Connection, queries: dict[str, tuple]):
+    """Execute independent read queries given as a dict of key to tuple
+    of SQL and parameters. Returns a dict of key to rows. With a read
+    pool the queries run concurrently on their own connections and the
+    rows are lists, otherwise they are cursors of `db`. Queries that
+    must see uncommitted changes of `db` can not use this.
+    """
+    pool = get_read_pool()
+    if pool is None:
+        return {key: db.execute(*query) for key, query in queries.items()}
+    started = time.perf_counter()
+    futures = {
+        key: pool.submit(fetch_all, *query) for key, query in queries.items()
+    }
+    rows = {key: future.result() for key, future in futures.items()}
+    elapsed = time.perf_counter() - started
+    record_db_time(elapsed)
+    count("db_read_pool_queries", len(queries))
+    count("db_read_pool_seconds", elapsed)
+    return rows
+
+
+def rows_as(cls):
+    """Return a cursor row factory creating `cls` instances from the
+    columns of each row, in order.
+    """
+    return lambda _, row: cls(*row)
+
+
 def close_db(e=None):
     """Close the connection."""
     if e:
@@ -41,10 +123,16 @@ def log_db_error(err: sqlite3.Error):
 
 def init_db():
     """Clear existing data and create new tables."""
+    # pylint: disable=import-outside-toplevel
+    from ruokareseptit.model.migrations import migrate
+
+    if os.path.exists(current_app.config["ARCHIVE_DATABASE"]):
+        os.remove(current_app.config["ARCHIVE_DATABASE"])
     db = get_db()
 
     with current_app.open_resource("schema.sql") as f:
         db.executescript(f.read().decode("utf8"))
+    migrate(db, echo=lambda _: None)
 
 
 @click.command("init-db")
@@ -54,6 +142,22 @@ def init_db_command():
     click.echo("Initialized the database.")
 
 
+@click.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations without losing existing data."""
+    # pylint: disable=import-outside-toplevel
+    from ruokareseptit.model.migrations import migrate, schema_version
+
+    db = get_db()
+    db.execute("PRAGMA journal_mode = WAL")
+    chunk_size = current_app.config["MIGRATION_CHUNK_SIZE"]
+    applied = migrate(db, chunk_size, click.echo)
+    click.echo(
+        f"Applied {applied} migrations, "
+        f"database is at version {schema_version(db)}."
+    )
+
+
 sqlite3.register_converter(
     "timestamp", lambda v: datetime.fromisoformat(v.decode())
 )
@@ -65,3 +169,4 @@ def init_app(app):
     """
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_command)
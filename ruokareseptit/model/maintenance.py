@@ -0,0 +1,214 @@
+"""Database maintenance
+
+Keeps the planner statistics fresh and returns free pages to the file
+system. Each worker process counts its successful write requests and
+runs maintenance in a background thread, on its own connection, after
+`MAINTENANCE_WRITES` writes or when `MAINTENANCE_INTERVAL` seconds have
+passed since the previous run. Requests never wait for it.
+
+A run takes the query plans of `KEY_QUERIES`, updates the statistics,
+runs `PRAGMA incremental_vacuum` if the database uses incremental auto
+vacuum, and logs the time of each step and the plans that changed.
+Runs after writes use `PRAGMA optimize`, which analyzes only the tables
+that need it, scheduled runs and `flask maintenance` run `ANALYZE`.
+`PRAGMA analysis_limit` bounds the rows read per index in both.
+"""
+
+import sqlite3
+import threading
+import time
+import click
+from flask import Flask
+from flask import current_app
+from flask import request
+
+# Queries whose plans are logged when they change
+KEY_QUERIES = {
+    "published recipes": """
+        SELECT id, title, rating, rating_count FROM recipes
+        WHERE published = 1 ORDER BY rating DESC LIMIT 5 OFFSET 0
+        """,
+    "title search": """
+        SELECT id, title, rating, rating_count FROM recipes
+        WHERE published = 1 AND title LIKE '%a%'
+        ORDER BY rating DESC LIMIT 5 OFFSET 0
+        """,
+    "title suggest": """
+        SELECT title FROM recipes WHERE published = 1
+        AND title >= 'a' COLLATE NOCASE AND title < 'b' COLLATE NOCASE
+        GROUP BY title COLLATE NOCASE ORDER BY title COLLATE NOCASE
+        LIMIT 10
+        """,
+    "recipe reviews": """
+        SELECT id, author_username, rating, review FROM user_reviews
+        WHERE recipe_id = 1 AND author_id IS NOT NULL
+        ORDER BY review IS NOT NULL DESC LIMIT 1000
+        """,
+    "category recipes": """
+        SELECT recipe_id FROM recipe_category WHERE category_id = 1
+        """,
+    "author recipes": """
+        SELECT id, title, published FROM recipes WHERE author_id = 1
+        ORDER BY created_at DESC, id DESC LIMIT 5 OFFSET 0
+        """,
+    "author reviews": """
+        SELECT id, recipe_id, rating FROM user_reviews WHERE author_id = 1
+        ORDER BY rating DESC, created_at DESC, id DESC LIMIT 5 OFFSET 0
+        """,
+}
+
+# Pages freed per incremental_vacuum step, the write lock is released
+# between the steps
+VACUUM_STEP_PAGES = 1000
+
+
+class Scheduler:
+    """Per process write counter and maintenance thread starter."""
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.writes = 0
+        self.last_run = time.monotonic()
+        self.lock = threading.Lock()
+        self.running = threading.Lock()
+
+    def record_request(self, write: bool):
+        """Count a write and start maintenance if it is due."""
+        config = self.app.config
+        with self.lock:
+            self.writes += write
+            by_writes = 0 < config["MAINTENANCE_WRITES"] <= self.writes
+            by_time = 0 < config["MAINTENANCE_INTERVAL"] <= (
+                time.monotonic() - self.last_run
+            )
+            if not (by_writes or by_time) or self.running.locked():
+                return
+            self.writes = 0
+            self.last_run = time.monotonic()
+        threading.Thread(
+            target=self.run,
+            kwargs={"full": by_time},
+            name="db-maintenance",
+            daemon=True,
+        ).start()
+
+    def run(self, full: bool):
+        """Run maintenance unless already running in this process."""
+        # A non-blocking acquire can not be a with statement
+        # pylint: disable-next=consider-using-with
+        if not self.running.acquire(blocking=False):
+            return
+        try:
+            with self.app.app_context():
+                run_maintenance(full=full)
+        except sqlite3.Error as err:
+            print(f"Maintenance failed: {err}")
+        finally:
+            self.running.release()
+
+
+def init_app(app: Flask):
+    """Register the write counter. This is called by the application
+    factory.
+    """
+    scheduler = Scheduler(app)
+    app.extensions["maintenance"] = scheduler
+
+    @app.after_request
+    def count_writes(response):
+        write = request.method == "POST" and response.status_code < 400
+        scheduler.record_request(write)
+        return response
+
+
+def query_plans(db: sqlite3.Connection) -> dict[str, list[str]]:
+    """Return the query plan of each of `KEY_QUERIES`."""
+    return {
+        name: [
+            row[3] for row in db.execute("EXPLAIN QUERY PLAN " + sql)
+        ]
+        for name, sql in KEY_QUERIES.items()
+    }
+
+
+def run_maintenance(full: bool = False, echo=print):
+    """Update the statistics and vacuum free pages on a new connection
+    to the database. With `full` all tables are analyzed.
+    """
+    started = time.perf_counter()
+    db = sqlite3.connect(current_app.config["DATABASE"], timeout=30)
+    try:
+        step = time.perf_counter()
+        # Preparing the key queries also marks their tables for optimize
+        before = query_plans(db)
+        timings = [("plans", time.perf_counter() - step)]
+
+        step = time.perf_counter()
+        limit = int(current_app.config["ANALYSIS_LIMIT"])
+        db.execute(f"PRAGMA analysis_limit = {limit}")
+        has_stats = db.execute(
+            "SELECT 1 FROM sqlite_schema WHERE name = 'sqlite_stat1'"
+        ).fetchone()
+        if full or not has_stats:
+            db.execute("ANALYZE")
+            timings.append(("analyze", time.perf_counter() - step))
+        else:
+            db.execute("PRAGMA optimize")
+            timings.append(("optimize", time.perf_counter() - step))
+
+        step = time.perf_counter()
+        freed = incremental_vacuum(db)
+        timings.append(("vacuum", time.perf_counter() - step))
+
+        after = query_plans(db)
+    finally:
+        db.close()
+
+    times = ", ".join(
+        f"{name} {secs * 1000:.0f} ms" for name, secs in timings
+    )
+    echo(
+        f"Maintenance done in {time.perf_counter() - started:.2f} s "
+        f"({times}), freed {freed} pages."
+    )
+    for name, plan in after.items():
+        if plan != before[name]:
+            echo(f"Plan of {name} changed:")
+            echo("  before: " + "; ".join(before[name]))
+            echo("  after:  " + "; ".join(plan))
+
+
+def incremental_vacuum(db: sqlite3.Connection) -> int:
+    """Free the unused pages in steps if the database uses incremental
+    auto vacuum. Returns the number of freed pages.
+    """
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    freed = 0
+    while True:
+        free = db.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            return freed
+        step = min(free, VACUUM_STEP_PAGES)
+        db.execute(f"PRAGMA incremental_vacuum({step})").fetchall()
+        db.commit()
+        freed += step
+
+
+@click.command("maintenance")
+@click.option(
+    "--enable-incremental-vacuum",
+    is_flag=True,
+    help="Switch to incremental auto vacuum with a full VACUUM first. "
+    "This blocks writes until done.",
+)
+def maintenance_command(enable_incremental_vacuum: bool):
+    """Analyze the database and vacuum free pages."""
+    if enable_incremental_vacuum:
+        started = time.perf_counter()
+        db = sqlite3.connect(current_app.config["DATABASE"])
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("VACUUM")
+        db.close()
+        click.echo(f"Vacuumed in {time.perf_counter() - started:.1f} s.")
+    run_maintenance(full=True, echo=click.echo)
@@ -0,0 +1,386 @@
+"""Request metrics
+
+Every request is timed from `before_request` until its response has
+been sent, which includes streamed templates. The time spent executing
+SQL statements and rendering templates is measured separately. Rows
+fetched lazily while a template renders count as render time.
+
+Each thread records to its own store, so recording takes no locks.
+The stores of a process are merged and written to
+`instance/metrics/<pid>.json` at most every `METRICS_FLUSH_INTERVAL`
+seconds. `/metrics` merges the files of all live worker processes
+and returns them in the Prometheus text format. Only the addresses in
+`METRICS_ALLOWED_ADDRESSES` can read it.
+"""
+
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+from flask import Flask
+from flask import abort
+from flask import current_app
+from flask import g
+from flask import has_request_context
+from flask import request
+from flask import Response
+from flask import before_render_template
+from flask import template_rendered
+
+# Upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Indexes of an endpoint entry, followed by the bucket counts
+COUNT, SECONDS, DB_SECONDS, RENDER_SECONDS, FIRST_BUCKET = range(5)
+
+# Caches in `app.extensions` whose statistics are exported
+CACHES = {
+    "user": "user_cache",
+    "search": "search_cache",
+    "fragment": "fragment_cache",
+}
+
+
+class RequestTimes:  # pylint: disable=too-few-public-methods
+    """Times of the current request."""
+
+    __slots__ = ("started", "db", "render", "render_started")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db = 0.0
+        self.render = 0.0
+        self.render_started = 0.0
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection adding the time spent executing statements to the
+    DB time of the current request.
+    """
+
+    def execute(self, sql, parameters=(), /):
+        """Execute `sql` and record the time spent."""
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_db_time(time.perf_counter() - started)
+
+    def executemany(self, sql, parameters, /):
+        """Execute `sql` for each of `parameters` and record the time
+        spent.
+        """
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            record_db_time(time.perf_counter() - started)
+
+
+class ProcessMetrics:
+    """Thread stores of one process. Each store is a dict with
+    `requests`, a dict of endpoint to entry list, and `counters`.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.local = threading.local()
+        self.lock = threading.Lock()  # for adding and merging stores
+        self.stores: list[tuple[threading.Thread, dict]] = []
+        self.retired = new_store()
+        self.flushed = time.monotonic()
+
+    def store(self) -> dict:
+        """Return the store of the current thread."""
+        store = getattr(self.local, "store", None)
+        if store is None:
+            store = self.local.store = new_store()
+            with self.lock:
+                self.stores.append((threading.current_thread(), store))
+        return store
+
+    def snapshot(self) -> dict:
+        """Merge the thread stores. Stores of finished threads are
+        merged once and dropped, as the server starts a thread for
+        every request.
+        """
+        with self.lock:
+            alive = []
+            for thread, store in self.stores:
+                if thread.is_alive():
+                    alive.append((thread, store))
+                else:
+                    merge(self.retired, store)
+            self.stores = alive
+            total = new_store()
+            merge(total, self.retired)
+            for _, store in alive:
+                merge(total, store)
+        return total
+
+
+def new_store() -> dict:
+    """Return an empty store."""
+    return {"requests": {}, "counters": {}}
+
+
+def merge(total: dict, store: dict):
+    """Add the values of `store` to `total`."""
+    for endpoint, entry in dict(store["requests"]).items():
+        entry = list(entry)
+        old = total["requests"].setdefault(endpoint, [0] * len(entry))
+        total["requests"][endpoint] = [a + b for a, b in zip(old, entry)]
+    for name, value in dict(store["counters"]).items():
+        total["counters"][name] = total["counters"].get(name, 0) + value
+
+
+def init_app(app: Flask):
+    """Register the request hooks and the `/metrics` endpoint. This is
+    called by the application factory.
+    """
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(finish_render, app)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+
+
+def process_metrics() -> ProcessMetrics:
+    """Return the metrics of this process. A forked worker process
+    starts with empty metrics.
+    """
+    metrics = current_app.extensions.get("metrics")
+    if metrics is None or metrics.pid != os.getpid():
+        metrics = current_app.extensions["metrics"] = ProcessMetrics()
+    return metrics
+
+
+def metrics_dir(app: Flask) -> str:
+    """Return the directory of the per process metrics files."""
+    return os.path.join(app.instance_path, "metrics")
+
+
+def clear_metrics(app: Flask):
+    """Remove the metrics files of earlier server processes."""
+    os.makedirs(metrics_dir(app), exist_ok=True)
+    for name in os.listdir(metrics_dir(app)):
+        os.remove(os.path.join(metrics_dir(app), name))
+
+
+def count(name: str, value: float = 1):
+    """Add `value` to counter `name` of this process."""
+    counters = process_metrics().store()["counters"]
+    counters[name] = counters.get(name, 0) + value
+
+
+def record_db_time(seconds: float):
+    """Add `seconds` to the DB time of the current request."""
+    if has_request_context() and "metrics" in g:
+        g.metrics.db += seconds
+
+
+def start_request():
+    """Start timing the request."""
+    g.metrics = RequestTimes()
+
+
+def start_render(*_, **__):
+    """Signal handler marking the start of rendering a template."""
+    if "metrics" in g:
+        g.metrics.render_started = time.perf_counter()
+
+
+def finish_render(*_, **__):
+    """Signal handler adding the rendering time of a template."""
+    if "metrics" in g and g.metrics.render_started:
+        times = g.metrics
+        times.render += time.perf_counter() - times.render_started
+        times.render_started = 0.0
+
+
+def finish_request(response: Response) -> Response:
+    """Record the request when its response has been sent."""
+    times = g.get("metrics")
+    if times is None:
+        return response
+    # The callback runs after the app context has been popped
+    # pylint: disable-next=protected-access
+    app = current_app._get_current_object()
+    metrics = process_metrics()
+    endpoint = request.endpoint or "unknown"
+
+    def record():
+        seconds = time.perf_counter() - times.started
+        entries = metrics.store()["requests"]
+        entry = entries.get(endpoint)
+        if entry is None:
+            entry = entries[endpoint] = [0] * (FIRST_BUCKET + len(BUCKETS))
+        entry[COUNT] += 1
+        entry[SECONDS] += seconds
+        entry[DB_SECONDS] += times.db
+        entry[RENDER_SECONDS] += times.render
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        if bucket < len(BUCKETS):
+            entry[FIRST_BUCKET + bucket] += 1
+        interval = app.config["METRICS_FLUSH_INTERVAL"]
+        if time.monotonic() - metrics.flushed > interval:
+            metrics.flushed = time.monotonic()
+            flush(app, metrics)
+
+    response.call_on_close(record)
+    return response
+
+
+def flush(app: Flask, metrics: ProcessMetrics):
+    """Write the metrics of this process to its file."""
+    snapshot = metrics.snapshot()
+    snapshot["caches"] = {
+        name: app.extensions[key].stats()
+        for name, key in CACHES.items()
+        if key in app.extensions
+    }
+    pools = app.extensions.get("db_read_pools", {})
+    snapshot["counters"]["db_read_pool_threads"] = (
+        app.config["DB_READ_POOL_SIZE"] if metrics.pid in pools else 0
+    )
+    os.makedirs(metrics_dir(app), exist_ok=True)
+    path = os.path.join(metrics_dir(app), f"{metrics.pid}.json")
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    os.replace(temp_path, path)
+
+
+def pid_alive(pid: int) -> bool:
+    """Return True if a process with `pid` exists."""
+    if not hasattr(os, "fork"):
+        # Signal 0 would terminate the process on Windows, which
+        # serves from a single process anyway
+        return pid == os.getpid()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_all(app: Flask) -> tuple[dict, int]:
+    """Merge the metrics files of all live processes. Returns the
+    merged store and the number of processes. Files of processes that
+    have exited (eg. earlier `flask run` servers or replaced workers)
+    are removed.
+    """
+    total = new_store()
+    total["caches"] = {}
+    processes = 0
+    for name in os.listdir(metrics_dir(app)):
+        pid, ext = os.path.splitext(name)
+        if ext != ".json" or not pid.isdigit():
+            continue
+        if not pid_alive(int(pid)):
+            try:
+                os.remove(os.path.join(metrics_dir(app), name))
+            except OSError:
+                pass
+            continue
+        try:
+            with open(os.path.join(metrics_dir(app), name), "rb") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        processes += 1
+        merge(total, snapshot)
+        for cache, stats in snapshot["caches"].items():
+            merged = total["caches"].setdefault(cache, {})
+            for key in ("size", "hits", "misses"):
+                merged[key] = merged.get(key, 0) + stats[key]
+    return total, processes
+
+
+def histogram_lines(requests: dict) -> list[str]:
+    """Return the latency histogram of each endpoint in `requests`."""
+    lines = ["# TYPE ruokareseptit_request_duration_seconds histogram"]
+    for endpoint, entry in sorted(requests.items()):
+        label = f'endpoint="{endpoint}"'
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS, entry[FIRST_BUCKET:]):
+            cumulative += bucket
+            lines.append(
+                "ruokareseptit_request_duration_seconds_bucket"
+                f'{{{label},le="{bound}"}} {cumulative}'
+            )
+        lines += [
+            "ruokareseptit_request_duration_seconds_bucket"
+            f'{{{label},le="+Inf"}} {entry[COUNT]}',
+            f"ruokareseptit_request_duration_seconds_sum{{{label}}} "
+            f"{entry[SECONDS]:.6f}",
+            f"ruokareseptit_request_duration_seconds_count{{{label}}} "
+            f"{entry[COUNT]}",
+        ]
+    return lines
+
+
+def cache_lines(caches: dict) -> list[str]:
+    """Return the hits, misses, entries and hit ratio of `caches`."""
+    lines = [
+        "# TYPE ruokareseptit_cache_hits_total counter",
+        "# TYPE ruokareseptit_cache_misses_total counter",
+        "# TYPE ruokareseptit_cache_entries gauge",
+        "# TYPE ruokareseptit_cache_hit_ratio gauge",
+    ]
+    for cache, stats in sorted(caches.items()):
+        lookups = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / lookups if lookups else 0.0
+        label = f'cache="{cache}"'
+        lines += [
+            f"ruokareseptit_cache_hits_total{{{label}}} {stats['hits']}",
+            f"ruokareseptit_cache_misses_total{{{label}}} {stats['misses']}",
+            f"ruokareseptit_cache_entries{{{label}}} {stats['size']}",
+            f"ruokareseptit_cache_hit_ratio{{{label}}} {ratio:.4f}",
+        ]
+    return lines
+
+
+def exposition(total: dict, processes: int) -> str:
+    """Format merged metrics in the Prometheus text format."""
+    lines = [
+        "# TYPE ruokareseptit_processes gauge",
+        f"ruokareseptit_processes {processes}",
+        *histogram_lines(total["requests"]),
+    ]
+    for name, index in (("db", DB_SECONDS), ("render", RENDER_SECONDS)):
+        lines.append(
+            f"# TYPE ruokareseptit_request_{name}_seconds_total counter"
+        )
+        for endpoint, entry in sorted(total["requests"].items()):
+            lines.append(
+                f"ruokareseptit_request_{name}_seconds_total"
+                f'{{endpoint="{endpoint}"}} {entry[index]:.6f}'
+            )
+    for name, value in sorted(total["counters"].items()):
+        kind = "gauge" if name.endswith("_threads") else "counter"
+        suffix = "" if kind == "gauge" else "_total"
+        lines += [
+            f"# TYPE ruokareseptit_{name}{suffix} {kind}",
+            f"ruokareseptit_{name}{suffix} {value:g}",
+        ]
+    lines += cache_lines(total["caches"])
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view():
+    """Return the metrics of all worker processes."""
+    if request.remote_addr not in current_app.config[
+        "METRICS_ALLOWED_ADDRESSES"
+    ]:
+        abort(404)
+    flush(current_app, process_metrics())
+    total, processes = read_all(current_app)
+    return Response(
+        exposition(total, processes),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,601 @@
+"""Versioned schema migrations
+
+`schema.sql` creates the baseline schema (version 0). Every migration
+after that is listed in `MIGRATIONS` and the version of the database is
+tracked in `PRAGMA user_version`. A migration is a list of steps:
+
+* `Script` runs DDL (eg. new columns, triggers and indexes) in a single
+  transaction. Building an index holds the write lock until it is done,
+  so large index builds should be steps of their own.
+* `Backfill` runs an UPDATE (or DELETE) over the rowid range of a table
+  in chunks, committing after every chunk, so that the write lock is
+  released between chunks and requests can be served while it runs.
+
+Progress of a running migration is stored in `migration_progress` after
+every step and chunk. An interrupted `flask migrate` continues from the
+last committed chunk.
+"""
+
+import sqlite3
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass(frozen=True)
+class Script:
+    """Migration step executing `sql` in one transaction."""
+
+    sql: str
+
+    def run(self, db: sqlite3.Connection, progress: "Progress", _, echo):
+        """Execute the script and mark the step done."""
+        echo(f"  step {progress.step}: script")
+        try:
+            db.executescript(
+                "BEGIN;\n"
+                + self.sql
+                + ";\n"
+                + progress.next_step_sql()
+                + ";\nCOMMIT;"
+            )
+        except sqlite3.Error:
+            db.rollback()
+            raise
+
+
+@dataclass(frozen=True)
+class Backfill:
+    """Migration step executing UPDATE or DELETE `sql` for rowid ranges
+    of `table`.
+    The `sql` must limit the rows with named parameters `:start`
+    (exclusive) and `:end` (inclusive).
+    """
+
+    table: str
+    sql: str
+
+    def run(
+        self, db: sqlite3.Connection, progress: "Progress", chunk_size, echo
+    ):
+        """Execute the statement in chunks, committing after each chunk."""
+        max_id = db.execute(
+            f"SELECT IFNULL(MAX(rowid), 0) FROM {self.table}"
+        ).fetchone()[0]
+        start = progress.last_id
+        echo(f"  step {progress.step}: backfill {self.table} {start}..")
+        while start < max_id:
+            end = start + chunk_size
+            with db:
+                db.execute(self.sql, {"start": start, "end": end})
+                progress.save(db, last_id=end)
+            start = end
+            echo(f"    {min(end, max_id)}/{max_id}")
+        with db:
+            db.execute(progress.next_step_sql())
+
+
+@dataclass
+class Progress:
+    """Committed progress of migration `version`."""
+
+    version: int
+    step: int = 0
+    last_id: int = 0
+
+    def save(self, db: sqlite3.Connection, last_id: int):
+        """Store the position of a backfill within the current step."""
+        self.last_id = last_id
+        db.execute(
+            """
+            INSERT OR REPLACE INTO migration_progress
+            (version, step, last_id) VALUES (?, ?, ?)
+            """,
+            [self.version, self.step, self.last_id],
+        )
+
+    def next_step_sql(self) -> str:
+        """SQL marking the current step done."""
+        return (
+            "INSERT OR REPLACE INTO migration_progress "
+            f"(version, step, last_id) VALUES ({int(self.version)}, "
+            f"{int(self.step) + 1}, 0)"
+        )
+
+
+MIGRATIONS: list[list[Script | Backfill]] = [
+    # 1: Rating aggregates of recipes, maintained by triggers
+    [
+        Script(
+            """
+            ALTER TABLE recipes
+            ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0;
+            ALTER TABLE recipes
+            ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0;
+            ALTER TABLE recipes
+            ADD COLUMN rating REAL
+            GENERATED ALWAYS AS (rating_sum * 1.0 / rating_count) VIRTUAL;
+
+            CREATE TRIGGER user_reviews_rating_insert
+            AFTER INSERT ON user_reviews
+            WHEN NEW.rating IS NOT NULL
+            BEGIN
+                UPDATE recipes
+                SET rating_sum = rating_sum + NEW.rating,
+                rating_count = rating_count + 1
+                WHERE id = NEW.recipe_id;
+            END;
+
+            CREATE TRIGGER user_reviews_rating_delete
+            AFTER DELETE ON user_reviews
+            WHEN OLD.rating IS NOT NULL
+            BEGIN
+                UPDATE recipes
+                SET rating_sum = rating_sum - OLD.rating,
+                rating_count = rating_count - 1
+                WHERE id = OLD.recipe_id;
+            END;
+
+            CREATE TRIGGER user_reviews_rating_update
+            AFTER UPDATE OF rating, recipe_id ON user_reviews
+            BEGIN
+                UPDATE recipes
+                SET rating_sum = rating_sum - OLD.rating,
+                rating_count = rating_count - 1
+                WHERE id = OLD.recipe_id AND OLD.rating IS NOT NULL;
+                UPDATE recipes
+                SET rating_sum = rating_sum + NEW.rating,
+                rating_count = rating_count + 1
+                WHERE id = NEW.recipe_id AND NEW.rating IS NOT NULL;
+            END
+            """
+        ),
+        Backfill(
+            "recipes",
+            """
+            UPDATE recipes SET (rating_sum, rating_count) = (
+                SELECT IFNULL(SUM(rating), 0), COUNT(rating)
+                FROM user_reviews
+                WHERE user_reviews.recipe_id = recipes.id
+            )
+            WHERE id > :start AND id <= :end
+            """,
+        ),
+        Script(
+            """
+            CREATE INDEX idx_published_recipes_rating
+            ON recipes(published, rating)
+            """
+        ),
+    ],
+    # 2: Order numbers of ingredients and instructions spaced by
+    # `recipes.ORDER_GAP`
+    [
+        Backfill(
+            "ingredients",
+            """
+            UPDATE ingredients SET order_number = order_number * 1024
+            WHERE id > :start AND id <= :end
+            """,
+        ),
+        Backfill(
+            "instructions",
+            """
+            UPDATE instructions SET order_number = order_number * 1024
+            WHERE id > :start AND id <= :end
+            """,
+        ),
+    ],
+    # 3: Similar recipes, computed by `flask similar-recipes`
+    [
+        Script(
+            """
+            CREATE TABLE recipe_neighbors (
+                recipe_id INTEGER REFERENCES recipes ON DELETE CASCADE,
+                neighbor_id INTEGER REFERENCES recipes ON DELETE CASCADE,
+                score REAL NOT NULL,
+                PRIMARY KEY (recipe_id, neighbor_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX idx_recipe_neighbors_neighbor
+            ON recipe_neighbors(neighbor_id)
+            """
+        ),
+    ],
+    # 4: One review per user and recipe. Duplicates are deleted keeping
+    # the one with text, then the one with rating, then the newest.
+    # The rating triggers keep the aggregates in sync.
+    [
+        Script(
+            """
+            CREATE INDEX idx_author_reviews
+            ON user_reviews(author_id, rating)
+            """
+        ),
+        Backfill(
+            "user_reviews",
+            """
+            DELETE FROM user_reviews
+            WHERE id > :start AND id <= :end
+            AND author_id IS NOT NULL
+            AND id != (
+                SELECT best.id FROM user_reviews AS best
+                WHERE best.author_id = user_reviews.author_id
+                AND best.recipe_id = user_reviews.recipe_id
+                ORDER BY best.review IS NOT NULL DESC,
+                best.rating IS NOT NULL DESC, best.id DESC
+                LIMIT 1
+            )
+            """,
+        ),
+        Script(
+            """
+            CREATE UNIQUE INDEX idx_author_recipe_reviews
+            ON user_reviews(author_id, recipe_id)
+            """
+        ),
+    ],
+    # 5: Creation and update times of recipes and reviews. Existing
+    # rows have NULL times, which sort as the oldest. Author dashboards
+    # are ordered newest first by range scans of the author indexes.
+    [
+        Script(
+            """
+            ALTER TABLE recipes ADD COLUMN created_at TIMESTAMP;
+            ALTER TABLE recipes ADD COLUMN updated_at TIMESTAMP;
+            ALTER TABLE user_reviews ADD COLUMN created_at TIMESTAMP;
+            ALTER TABLE user_reviews ADD COLUMN updated_at TIMESTAMP;
+
+            CREATE TRIGGER recipes_created_at
+            AFTER INSERT ON recipes
+            BEGIN
+                UPDATE recipes
+                SET created_at = CURRENT_TIMESTAMP,
+                updated_at = CURRENT_TIMESTAMP
+                WHERE id = NEW.id;
+            END;
+
+            CREATE TRIGGER recipes_updated_at
+            AFTER UPDATE OF title, summary, preparation_time, cooking_time,
+            skill_level, portions, published ON recipes
+            BEGIN
+                UPDATE recipes
+                SET updated_at = CURRENT_TIMESTAMP
+                WHERE id = NEW.id;
+            END;
+
+            CREATE TRIGGER user_reviews_created_at
+            AFTER INSERT ON user_reviews
+            BEGIN
+                UPDATE user_reviews
+                SET created_at = CURRENT_TIMESTAMP,
+                updated_at = CURRENT_TIMESTAMP
+                WHERE id = NEW.id;
+            END;
+
+            CREATE TRIGGER user_reviews_updated_at
+            AFTER UPDATE OF rating, review ON user_reviews
+            BEGIN
+                UPDATE user_reviews
+                SET updated_at = CURRENT_TIMESTAMP
+                WHERE id = NEW.id;
+            END
+            """
+        ),
+        Script(
+            """
+            CREATE INDEX idx_author_recipes_created
+            ON recipes(author_id, created_at, id, title, published);
+            DROP INDEX idx_author_recipes
+            """
+        ),
+        Script(
+            """
+            CREATE INDEX idx_author_reviews_rating_created
+            ON user_reviews(author_id, rating, created_at, id);
+            DROP INDEX idx_author_reviews
+            """
+        ),
+    ],
+    # 6: Recipes of a category, for deleting orphaned categories
+    [
+        Script(
+            """
+            CREATE INDEX idx_category_recipes
+            ON recipe_category(category_id)
+            """
+        ),
+    ],
+    # 7: Partial indexes of published recipes. The rating index covers
+    # the counts of recipe lists and title search. `published` is
+    # included, as SQLite reads it from the index even though it is 1.
+    [
+        Script(
+            """
+            CREATE INDEX idx_published_rating
+            ON recipes(rating, title, rating_count, published)
+            WHERE published = 1
+            """
+        ),
+        Script(
+            """
+            CREATE INDEX idx_published_title
+            ON recipes(title COLLATE NOCASE, published) WHERE published = 1
+            """
+        ),
+        Script(
+            """
+            DROP INDEX idx_published_recipes;
+            DROP INDEX idx_published_recipes_rating;
+            DROP INDEX idx_recipe_title
+            """
+        ),
+    ],
+    # 8: Username of the author copied to recipes and reviews, kept in
+    # sync by triggers, so that pages do not look up every author
+    [
+        Script(
+            """
+            ALTER TABLE recipes ADD COLUMN author_username TEXT;
+            ALTER TABLE user_reviews ADD COLUMN author_username TEXT;
+
+            CREATE TRIGGER recipes_author_insert
+            AFTER INSERT ON recipes
+            BEGIN
+                UPDATE recipes SET author_username = (
+                    SELECT username FROM users WHERE id = NEW.author_id
+                )
+                WHERE id = NEW.id;
+            END;
+
+            CREATE TRIGGER recipes_author_update
+            AFTER UPDATE OF author_id ON recipes
+            BEGIN
+                UPDATE recipes SET author_username = (
+                    SELECT username FROM users WHERE id = NEW.author_id
+                )
+                WHERE id = NEW.id;
+            END;
+
+            CREATE TRIGGER user_reviews_author_insert
+            AFTER INSERT ON user_reviews
+            BEGIN
+                UPDATE user_reviews SET author_username = (
+                    SELECT username FROM users WHERE id = NEW.author_id
+                )
+                WHERE id = NEW.id;
+            END;
+
+            CREATE TRIGGER user_reviews_author_update
+            AFTER UPDATE OF author_id ON user_reviews
+            BEGIN
+                UPDATE user_reviews SET author_username = (
+                    SELECT username FROM users WHERE id = NEW.author_id
+                )
+                WHERE id = NEW.id;
+            END;
+
+            CREATE TRIGGER users_username_update
+            AFTER UPDATE OF username ON users
+            BEGIN
+                UPDATE recipes SET author_username = NEW.username
+                WHERE author_id = NEW.id;
+                UPDATE user_reviews SET author_username = NEW.username
+                WHERE author_id = NEW.id;
+            END
+            """
+        ),
+        Backfill(
+            "recipes",
+            """
+            UPDATE recipes SET author_username = (
+                SELECT username FROM users WHERE id = recipes.author_id
+            )
+            WHERE id > :start AND id <= :end
+            """,
+        ),
+        Backfill(
+            "user_reviews",
+            """
+            UPDATE user_reviews SET author_username = (
+                SELECT username FROM users WHERE id = user_reviews.author_id
+            )
+            WHERE id > :start AND id <= :end
+            """,
+        ),
+    ],
+    # 9: Version of the recipe content shown below its header, bumped by
+    # triggers on every change. Rendered content is cached by recipe id
+    # and version, so all worker processes see the changes.
+    [
+        Script(
+            """
+            ALTER TABLE recipes
+            ADD COLUMN content_version INTEGER NOT NULL DEFAULT 0;
+
+            CREATE TRIGGER recipes_content_update
+            AFTER UPDATE OF summary, portions ON recipes
+            WHEN OLD.summary IS NOT NEW.summary
+            OR OLD.portions IS NOT NEW.portions
+            BEGIN
+                UPDATE recipes SET content_version = content_version + 1
+                WHERE id = NEW.id;
+            END;
+
+            CREATE TRIGGER ingredients_content_insert
+            AFTER INSERT ON ingredients
+            BEGIN
+                UPDATE recipes SET content_version = content_version + 1
+                WHERE id = NEW.recipe_id;
+            END;
+
+            CREATE TRIGGER ingredients_content_update
+            AFTER UPDATE ON ingredients
+            BEGIN
+                UPDATE recipes SET content_version = content_version + 1
+                WHERE id IN (OLD.recipe_id, NEW.recipe_id);
+            END;
+
+            CREATE TRIGGER ingredients_content_delete
+            AFTER DELETE ON ingredients
+            BEGIN
+                UPDATE recipes SET content_version = content_version + 1
+                WHERE id = OLD.recipe_id;
+            END;
+
+            CREATE TRIGGER instructions_content_insert
+            AFTER INSERT ON instructions
+            BEGIN
+                UPDATE recipes SET content_version = content_version + 1
+                WHERE id = NEW.recipe_id;
+            END;
+
+            CREATE TRIGGER instructions_content_update
+            AFTER UPDATE ON instructions
+            BEGIN
+                UPDATE recipes SET content_version = content_version + 1
+                WHERE id IN (OLD.recipe_id, NEW.recipe_id);
+            END;
+
+            CREATE TRIGGER instructions_content_delete
+            AFTER DELETE ON instructions
+            BEGIN
+                UPDATE recipes SET content_version = content_version + 1
+                WHERE id = OLD.recipe_id;
+            END;
+
+            CREATE TRIGGER recipe_category_content_insert
+            AFTER INSERT ON recipe_category
+            BEGIN
+                UPDATE recipes SET content_version = content_version + 1
+                WHERE id = NEW.recipe_id;
+            END;
+
+            CREATE TRIGGER recipe_category_content_delete
+            AFTER DELETE ON recipe_category
+            BEGIN
+                UPDATE recipes SET content_version = content_version + 1
+                WHERE id = OLD.recipe_id;
+            END;
+
+            CREATE TRIGGER categories_content_update
+            AFTER UPDATE OF title ON categories
+            WHEN OLD.title IS NOT NEW.title
+            BEGIN
+                UPDATE recipes SET content_version = content_version + 1
+                WHERE id IN (
+                    SELECT recipe_id FROM recipe_category
+                    WHERE category_id = NEW.id
+                );
+            END
+            """
+        ),
+    ],
+    # 10: Version of the published recipe data, bumped by triggers when
+    # recipes are added, deleted, renamed, published or rated. Search
+    # results are cached by the version, and as it is in the database
+    # a write seen by one worker process invalidates them in all.
+    [
+        Script(
+            """
+            CREATE TABLE data_version (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER NOT NULL
+            );
+            INSERT INTO data_version (id, version) VALUES (0, 0);
+
+            CREATE TRIGGER recipes_data_version_insert
+            AFTER INSERT ON recipes
+            BEGIN
+                UPDATE data_version SET version = version + 1;
+            END;
+
+            CREATE TRIGGER recipes_data_version_update
+            AFTER UPDATE OF title, published, rating_sum, rating_count
+            ON recipes
+            WHEN OLD.title IS NOT NEW.title
+            OR OLD.published IS NOT NEW.published
+            OR OLD.rating_sum IS NOT NEW.rating_sum
+            OR OLD.rating_count IS NOT NEW.rating_count
+            BEGIN
+                UPDATE data_version SET version = version + 1;
+            END;
+
+            CREATE TRIGGER recipes_data_version_delete
+            AFTER DELETE ON recipes
+            BEGIN
+                UPDATE data_version SET version = version + 1;
+            END
+            """
+        ),
+    ],
+    # 11: Version of the users, bumped by triggers when users are
+    # deleted or renamed. Logged in users are cached by the version, so
+    # the change invalidates the cache in all worker processes.
+    [
+        Script(
+            """
+            CREATE TABLE users_version (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER NOT NULL
+            );
+            INSERT INTO users_version (id, version) VALUES (0, 0);
+
+            CREATE TRIGGER users_version_update
+            AFTER UPDATE OF username ON users
+            WHEN OLD.username IS NOT NEW.username
+            BEGIN
+                UPDATE users_version SET version = version + 1;
+            END;
+
+            CREATE TRIGGER users_version_delete
+            AFTER DELETE ON users
+            BEGIN
+                UPDATE users_version SET version = version + 1;
+            END
+            """
+        ),
+    ],
+]
+
+
+def schema_version(db: sqlite3.Connection) -> int:
+    """Return the migration version of the database."""
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(
+    db: sqlite3.Connection,
+    chunk_size: int = 1000,
+    echo: Callable[[str], None] = print,
+) -> int:
+    """Apply all pending migrations. Backfills commit after every
+    `chunk_size` rows. Returns the number of migrations applied.
+    """
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS migration_progress (
+            version INTEGER PRIMARY KEY,
+            step INTEGER NOT NULL,
+            last_id INTEGER NOT NULL
+        )
+        """
+    )
+    applied = 0
+    for version, steps in enumerate(MIGRATIONS, start=1):
+        if version <= schema_version(db):
+            continue
+        echo(f"Migration {version}:")
+        row = db.execute(
+            "SELECT step, last_id FROM migration_progress WHERE version = ?",
+            [version],
+        ).fetchone()
+        progress = Progress(version, *(row or (0, 0)))
+        for step in steps[progress.step :]:
+            step.run(db, progress, chunk_size, echo)
+            progress = Progress(version, progress.step + 1)
+        with db:
+            db.execute(
+                "DELETE FROM migration_progress WHERE version = ?", [version]
+            )
+            db.execute(f"PRAGMA user_version = {int(version)}")
+        applied += 1
+    return applied
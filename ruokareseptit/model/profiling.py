@@ -0,0 +1,191 @@
+"""Sampling profiler for slow requests
+
+A request is profiled when it has the header `X-Profile` with the value
+of `PROFILE_TOKEN`, when it is picked as one in `PROFILE_SAMPLE_RATE`
+requests, or from when it has been running for `PROFILE_SLOW_SECONDS`.
+A sampler thread records the stack of the request thread every
+`PROFILE_INTERVAL` seconds until the response has been sent. The stacks
+are written in the collapsed stack format (one `frame;frame;... count`
+line per stack), which flame graph tools and speedscope can open, to
+`instance/profiles/<time>-<endpoint>-<trigger>-<ms>.txt`.
+
+All triggers are disabled by default. Then a request only checks the
+settings, and the sampler thread is not started.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from flask import Flask
+from flask import current_app
+from flask import g
+from flask import request
+from flask import Response
+
+# Frames deeper than this are left out of the samples
+MAX_STACK_DEPTH = 128
+
+# Keeps concurrent first requests from starting two samplers
+sampler_lock = threading.Lock()
+
+
+class Profile:  # pylint: disable=too-few-public-methods
+    """Stack samples of one request."""
+
+    __slots__ = ("started", "trigger", "stacks")
+
+    def __init__(self, started: float, trigger: str):
+        self.started = started
+        self.trigger = trigger
+        self.stacks: Counter[str] = Counter()
+
+
+class Sampler:
+    """Sampler thread of one process, with the profiled and watched
+    requests by thread id.
+    """
+
+    def __init__(self, interval: float, slow_seconds: float):
+        self.pid = os.getpid()
+        self.interval = interval
+        self.slow_seconds = slow_seconds
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.profiles: dict[int, Profile] = {}
+        self.watched: dict[int, float] = {}
+        threading.Thread(
+            target=self.run, name="profile-sampler", daemon=True
+        ).start()
+
+    def start(self, trigger: str | None):
+        """Profile the current request thread with `trigger`, or watch
+        it for the latency threshold if `trigger` is None.
+        """
+        ident = threading.get_ident()
+        with self.lock:
+            if trigger:
+                self.profiles[ident] = Profile(time.perf_counter(), trigger)
+            else:
+                self.watched[ident] = time.perf_counter()
+        self.wakeup.set()
+
+    def stop(self) -> Profile | None:
+        """Stop profiling or watching the current request thread and
+        return its profile, if any.
+        """
+        ident = threading.get_ident()
+        with self.lock:
+            self.watched.pop(ident, None)
+            return self.profiles.pop(ident, None)
+
+    def run(self):
+        """Take samples while there are requests to profile or watch."""
+        while True:
+            with self.lock:
+                idle = not self.profiles and not self.watched
+                if idle:
+                    self.wakeup.clear()
+            if idle:
+                self.wakeup.wait()
+            time.sleep(self.interval)
+            self.sample()
+
+    def sample(self):
+        """Record the stacks of the profiled threads and start profiling
+        watched requests that are over the latency threshold.
+        """
+        now = time.perf_counter()
+        with self.lock:
+            for ident, started in list(self.watched.items()):
+                if now - started >= self.slow_seconds:
+                    del self.watched[ident]
+                    self.profiles[ident] = Profile(started, "slow")
+            profiles = dict(self.profiles)
+        if not profiles:
+            return
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        for ident, profile in profiles.items():
+            frame = frames.get(ident)
+            if frame is not None:
+                profile.stacks[collapse(frame)] += 1
+
+
+def collapse(frame) -> str:
+    """Return the stack of `frame` as `;` separated frames, outermost
+    first.
+    """
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        path = code.co_filename.replace(os.sep, "/").split("/")[-2:]
+        names.append(f"{code.co_name} ({'/'.join(path)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def init_app(app: Flask):
+    """Register the profiling request hooks. This is called by the
+    application factory.
+    """
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+
+
+def sampler() -> Sampler:
+    """Return the sampler of this process, starting it on first use.
+    A forked worker process starts its own sampler thread.
+    """
+    with sampler_lock:
+        current = current_app.extensions.get("profile_sampler")
+        if current is None or current.pid != os.getpid():
+            current = current_app.extensions["profile_sampler"] = Sampler(
+                current_app.config["PROFILE_INTERVAL"],
+                current_app.config["PROFILE_SLOW_SECONDS"],
+            )
+        return current
+
+
+def start_profile():
+    """Start profiling the request if a trigger matches."""
+    config = current_app.config
+    trigger = None
+    token = config["PROFILE_TOKEN"]
+    rate = config["PROFILE_SAMPLE_RATE"]
+    if token and request.headers.get("X-Profile") == token:
+        trigger = "header"
+    elif rate and random.randrange(rate) == 0:
+        trigger = "sampled"
+    elif not config["PROFILE_SLOW_SECONDS"]:
+        return
+    sampler().start(trigger)
+    g.profiled = True
+
+
+def finish_profile(response: Response) -> Response:
+    """Write the profile when the response has been sent."""
+    if not g.get("profiled"):
+        return response
+    current = sampler()
+    profiles_dir = os.path.join(current_app.instance_path, "profiles")
+    endpoint = request.endpoint or "unknown"
+
+    def write():
+        profile = current.stop()
+        if profile is None or not profile.stacks:
+            return
+        elapsed = (time.perf_counter() - profile.started) * 1000
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        name = f"{stamp}-{endpoint}-{profile.trigger}-{elapsed:.0f}ms.txt"
+        os.makedirs(profiles_dir, exist_ok=True)
+        with open(
+            os.path.join(profiles_dir, name), "w", encoding="utf-8"
+        ) as f:
+            for stack, count in profile.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    response.call_on_close(write)
+    return response
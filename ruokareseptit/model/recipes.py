@@ -1,16 +1,77 @@
 """SQL queries for recipes"""
 
+import json
 import re
+import string
+from dataclasses import dataclass
 from sqlite3 import Cursor
 from flask import current_app
 
+from ruokareseptit.model.archive import reviews_source
+from ruokareseptit.model.cache import data_version
+from ruokareseptit.model.db import read_many, rows_as
+from ruokareseptit.model.similar import fetch_similar_recipes
+
+# Ingredients and instructions are ordered by `order_number`, which are
+# spaced `ORDER_GAP` apart. Moving a row sets its `order_number` between
+# its new neighbours, and rows are renumbered only when there is no gap.
+ORDER_GAP = 1024
+ORDERED_TABLES = ("ingredients", "instructions")
+
+ASCII_LOWERCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+@dataclass(slots=True, frozen=True)
+class RecipeListItem:
+    """Row of the published recipe and search result lists"""
+
+    id: int
+    title: str
+    rating: float | None
+    rating_count: int
+
+
+@dataclass(slots=True, frozen=True)
+class UserRecipeListItem:
+    """Row of the list of user's own recipes"""
+
+    id: int
+    title: str
+    published: int
+
 
 # SQL queries for READ operations ########################################
 
 
 def search_recipes_title(db: Cursor, search_term: str, page: int):
     """Search all published recipes, paginated. Returns a tuple of
-    Cursor, number of recipes and number of pages.
+    list of recipes, number of recipes and number of pages. Results
+    are cached by the search term and page until the published data
+    changes or `SEARCH_CACHE_TTL` expires.
+    """
+    search_term = search_term.strip()
+    page = max(page, 1)
+    page_size = int(current_app.config["RECIPE_LIST_PAGE_SIZE"])
+    # LIKE is case insensitive only for ASCII characters
+    cache_key = (
+        search_term.translate(ASCII_LOWERCASE),
+        page,
+        page_size,
+        data_version(db),
+    )
+    search_cache = current_app.extensions["search_cache"]
+    result = search_cache.get(cache_key)
+    if result is None:
+        result = query_recipes_title(db, search_term, page, page_size)
+        search_cache.set(cache_key, result)
+    return result
+
+
+def query_recipes_title(
+    db: Cursor, search_term: str, page: int, page_size: int
+):
+    """Query published recipes with `search_term` in title. Returns
+    a tuple of list of recipes, number of recipes and number of pages.
     """
     search_term = "%" + search_term + "%"
     total_rows: int = db.execute(
@@ -22,29 +83,62 @@ def search_recipes_title(db: Cursor, search_term: str, page: int):
         """,
         [search_term],
     ).fetchone()[0]
-    page_size = int(current_app.config["RECIPE_LIST_PAGE_SIZE"])
     total_pages = (total_rows - 1) // page_size + 1
     offset = max(min(total_pages - 1, page - 1), 0) * page_size
     pub_recipes = db.execute(
         """
-        SELECT recipes.*, AVG(user_reviews.rating) AS rating,
-        COUNT(user_reviews.rating) AS rating_count
-        FROM recipes LEFT JOIN user_reviews
-        ON recipes.id = user_reviews.recipe_id
+        SELECT id, title, rating, rating_count
+        FROM recipes
         WHERE published = 1
         AND title LIKE ?
-        GROUP BY recipes.id
         ORDER BY rating DESC
         LIMIT ? OFFSET ?
         """,
         [search_term, page_size, offset],
     )
+    pub_recipes.row_factory = rows_as(RecipeListItem)
+    pub_recipes = pub_recipes.fetchall()
     return pub_recipes, total_rows, total_pages
 
 
+def suggest_recipe_titles(db: Cursor, prefix: str, limit: int):
+    """Query at most `limit` distinct titles of published recipes and
+    names of categories starting with `prefix`. Returns a tuple of
+    lists of titles and category names.
+    """
+    # Range scan on idx_published_title, which is ordered by the title,
+    # so the first `limit` matches are found without sorting
+    titles = db.execute(
+        """
+        SELECT title
+        FROM recipes
+        WHERE published = 1
+        AND title >= :lower COLLATE NOCASE
+        AND title < :upper COLLATE NOCASE
+        GROUP BY title COLLATE NOCASE
+        ORDER BY title COLLATE NOCASE
+        LIMIT :limit
+        """,
+        {"lower": prefix, "upper": prefix + "\U0010ffff", "limit": limit},
+    ).fetchall()
+    # There are few categories, so scanning their titles is fast enough
+    pattern = re.sub(r"([\\%_])", r"\\\1", prefix) + "%"
+    categories = db.execute(
+        """
+        SELECT title
+        FROM categories
+        WHERE title LIKE ? ESCAPE '\\'
+        ORDER BY title
+        LIMIT ?
+        """,
+        [pattern, limit],
+    ).fetchall()
+    return [row[0] for row in titles], [row[0] for row in categories]
+
+
 def list_published_recipes(db: Cursor, page: int):
     """Query all published recipes, paginated. Returns a tuple of
-    Cursor, number of recipes and number of pages.
+    list of recipes, number of recipes and number of pages.
     """
     total_rows: int = db.execute(
         """
@@ -58,107 +152,136 @@ def list_published_recipes(db: Cursor, page: int):
     offset = max(min(total_pages - 1, page - 1), 0) * page_size
     pub_recipes = db.execute(
         """
-        SELECT recipes.*, AVG(user_reviews.rating) AS rating,
-        COUNT(user_reviews.rating) AS rating_count
-        FROM recipes LEFT JOIN user_reviews
-        ON recipes.id = user_reviews.recipe_id
+        SELECT id, title, rating, rating_count
+        FROM recipes
         WHERE published = 1
-        GROUP BY recipes.id
         ORDER BY rating DESC
         LIMIT ? OFFSET ?
         """,
         [page_size, offset],
     )
-    return pub_recipes, total_rows, total_pages
+    pub_recipes.row_factory = rows_as(RecipeListItem)
+    return pub_recipes.fetchall(), total_rows, total_pages
+
 
+def list_top_recipe_ids(db: Cursor, limit: int) -> list[int]:
+    """Query ids of the `limit` best rated published recipes."""
+    rows = db.execute(
+        """
+        SELECT id
+        FROM recipes
+        WHERE published = 1
+        ORDER BY rating DESC
+        LIMIT ?
+        """,
+        [limit],
+    )
+    return [row[0] for row in rows]
 
-def fetch_published_recipe_context(db: Cursor, recipe_id: int):
-    """Fetch a recipe from database. The recipe must be
-    published. Returns a dict to be used as a `render_template`
-    context.
+
+def fetch_published_recipe(db: Cursor, recipe_id: int):
+    """Fetch a recipe from database. The recipe must be published.
+    The row includes `content_version`, which triggers bump on every
+    change of the content below the recipe header.
     """
-    recipe_row = db.execute(
+    return db.execute(
         """
-        SELECT recipes.*, users.username, AVG(user_reviews.rating) AS rating,
-        COUNT(user_reviews.rating) AS rating_count
-        FROM recipes LEFT JOIN user_reviews
-        ON recipes.id = user_reviews.recipe_id
-        JOIN users
-        ON recipes.author_id = users.id
-        WHERE recipes.id = ? AND published = 1
+        SELECT *
+        FROM recipes
+        WHERE id = ? AND published = 1
+        AND author_id IS NOT NULL
         """,
         [recipe_id],
     ).fetchone()
 
-    if not recipe_row["title"]:
-        # have to check for title nullness because row is returned and it has
-        # rating_count (0) even for recipies that do not exist in the database
-        return None
 
-    related = fetch_recipe_related(db, recipe_id)
-    return {"recipe": recipe_row, **related}
+def fetch_published_recipe_context(
+    db: Cursor, recipe_row, archived: bool = False, content: bool = True
+):
+    """Fetch the related rows of a recipe read with
+    `fetch_published_recipe`. Returns a dict to be used as a
+    `render_template` context. Archived reviews are included if
+    `archived` is true. Without `content` the ingredients,
+    instructions and categories are not read.
+    """
+    recipe_id = recipe_row["id"]
+    related = fetch_recipe_related(db, recipe_id, True, archived, content)
+    similar_recipes = fetch_similar_recipes(db, recipe_id)
+    return {
+        "recipe": recipe_row,
+        "similar_recipes": similar_recipes,
+        **related,
+    }
 
 
-def fetch_recipe_related(db: Cursor, recipe_id):
+def fetch_recipe_related(
+    db: Cursor, recipe_id, concurrent=False, archived=False, content=True
+):
     """Fetch content from related tables. Returns a dict of each
-    key `ingredients`, `instructions`, `categories` and `user_reviews`.
+    key `ingredients`, `instructions`, `categories` and `reviews`.
+    With `concurrent` ingredients, instructions and categories are
+    read concurrently on the read pool (see `read_many`). Reviews are
+    always read lazily from `db`, so that they can be streamed. With
+    `archived` archived reviews are included. Without `content` only
+    the reviews are read.
     """
     ingredients_limit = current_app.config["RECIPE_INGREDIENTS_MAX"]
-    ingredients = db.execute(
-        """
-        SELECT * FROM ingredients WHERE recipe_id = ?
-        ORDER BY order_number LIMIT ?
-        """,
-        [recipe_id, ingredients_limit],
-    )
-
     instructions_limit = current_app.config["RECIPE_INSTRUCTIONS_MAX"]
-    instructions = db.execute(
-        """
-        SELECT * FROM instructions WHERE recipe_id = ?
-        ORDER BY order_number LIMIT ?
-        """,
-        [recipe_id, instructions_limit],
-    )
-
     recipe_categories_limit = current_app.config["RECIPE_CATEGORIES_MAX"]
-    recipe_categories = db.execute(
-        """
-        SELECT categories.id, categories.title
-        FROM recipe_category
-        JOIN categories
-        ON recipe_category.category_id = categories.id
-        WHERE recipe_category.recipe_id = ?
-        LIMIT ?
-        """,
-        [recipe_id, recipe_categories_limit],
-    )
+    queries = {
+        "ingredients": (
+            """
+            SELECT * FROM ingredients WHERE recipe_id = ?
+            ORDER BY order_number, id LIMIT ?
+            """,
+            [recipe_id, ingredients_limit],
+        ),
+        "instructions": (
+            """
+            SELECT * FROM instructions WHERE recipe_id = ?
+            ORDER BY order_number, id LIMIT ?
+            """,
+            [recipe_id, instructions_limit],
+        ),
+        "categories": (
+            """
+            SELECT categories.id, categories.title
+            FROM recipe_category
+            JOIN categories
+            ON recipe_category.category_id = categories.id
+            WHERE recipe_category.recipe_id = ?
+            LIMIT ?
+            """,
+            [recipe_id, recipe_categories_limit],
+        ),
+    }
+    if not content:
+        related = {}
+    elif concurrent:
+        related = read_many(db, queries)
+    else:
+        related = {key: db.execute(*query) for key, query in queries.items()}
 
     reviews_limit = current_app.config["RECIPE_USER_REVIEWS_MAX"]
     reviews = db.execute(
-        """
-        SELECT user_reviews.*, users.username
-        FROM user_reviews JOIN users ON user_reviews.author_id = users.id
-        WHERE user_reviews.recipe_id = ?
-        ORDER BY user_reviews.review IS NOT NULL DESC
+        f"""
+        SELECT *
+        FROM {reviews_source(db, archived)}
+        WHERE recipe_id = ? AND author_id IS NOT NULL
+        ORDER BY review IS NOT NULL DESC
         LIMIT ?
         """,
         [recipe_id, reviews_limit],
     )
 
-    return {
-        "ingredients": ingredients,
-        "instructions": instructions,
-        "categories": recipe_categories,
-        "reviews": reviews,
-    }
+    return {**related, "reviews": reviews}
 
 
 # SQL queries for authenticated READ operations ##########################
 
 
 def list_user_recipes(db: Cursor, author_id: int, page: int):
-    """Query recipes of user `author_id`"""
+    """Query recipes of user `author_id`, newest first"""
     total_rows = db.execute(
         """
         SELECT count(*)
@@ -172,13 +295,16 @@ def list_user_recipes(db: Cursor, author_id: int, page: int):
     offset = max(min(total_pages - 1, page - 1), 0) * page_size
     user_recipes = db.execute(
         """
-        SELECT *
+        SELECT id, title, published
         FROM recipes
-        WHERE author_id = ? LIMIT ? OFFSET ?
+        WHERE author_id = ?
+        ORDER BY created_at DESC, id DESC
+        LIMIT ? OFFSET ?
         """,
         [author_id, page_size, offset],
     )
-    return user_recipes, total_rows, total_pages
+    user_recipes.row_factory = rows_as(UserRecipeListItem)
+    return user_recipes.fetchall(), total_rows, total_pages
 
 
 def fetch_author_recipe_context(db: Cursor, recipe_id: int, author_id: int):
@@ -211,17 +337,15 @@ def update_recipe_ingredients(
     `ingredients_ID_amount` and `ingredients_ID_title`.
     Triggers also move, delete and add row actions.
     """
-    ingredient_data = {}
+    ingredient_data, moves = {}, []
     for key in fields:
         field = re.match(r"^ingredients_(\d+)_(\w+)$", key)
         if field:
             i_id = field.group(1)
             column = field.group(2)
             value = fields[key]
-            if column == "up":
-                move_ingredients_row_up(db, recipe_id, i_id)
-            elif column == "down":
-                move_ingredients_row_down(db, recipe_id, i_id)
+            if column in ("up", "down"):
+                moves.append((int(i_id), column))
             elif column == "delete":
                 delete_ingredients_row(db, recipe_id, i_id)
             else:
@@ -232,6 +356,8 @@ def update_recipe_ingredients(
     for i_id, i_fields in ingredient_data.items():
         update_ingredients_row(db, recipe_id, i_id, i_fields)
 
+    move_rows(db, "ingredients", recipe_id, moves)
+
     if fields.get("ingredients_add_row", False):
         add_ingredients_row(db, recipe_id)
 
@@ -243,17 +369,15 @@ def update_recipe_instructions(
     `instructions_ID_instruction`. Triggers also move,
     delete and add row actions.
     """
-    instruction_data = {}
+    instruction_data, moves = {}, []
     for key in fields:
         field = re.match(r"^instructions_(\d+)_(\w+)$", key)
         if field:
             i_id = field.group(1)
             column = field.group(2)
             value = fields[key]
-            if column == "up":
-                move_instructions_row_up(db, recipe_id, i_id)
-            elif column == "down":
-                move_instructions_row_down(db, recipe_id, i_id)
+            if column in ("up", "down"):
+                moves.append((int(i_id), column))
             elif column == "delete":
                 delete_instructions_row(db, recipe_id, i_id)
             else:
@@ -264,6 +388,8 @@ def update_recipe_instructions(
     for i_id, i_fields in instruction_data.items():
         update_instructions_row(db, recipe_id, i_id, i_fields)
 
+    move_rows(db, "instructions", recipe_id, moves)
+
     if fields.get("instructions_add_row", False):
         add_instructions_row(db, recipe_id)
 
@@ -361,15 +487,16 @@ def delete_author_recipe(db: Cursor, recipe_id: int, author_id: int):
 
 
 def add_ingredients_row(db: Cursor, recipe_id: int):
-    """Add ingredients row to recipe"""
+    """Add ingredients row to the end of recipe"""
     cursor = db.execute(
         """
         INSERT INTO ingredients (recipe_id, order_number)
-        SELECT ?, IFNULL(MAX(order_number), 0) + 1
-        FROM ingredients
-        WHERE recipe_id = ?
+        VALUES (?, IFNULL((
+            SELECT order_number FROM ingredients WHERE recipe_id = ?
+            ORDER BY order_number DESC LIMIT 1
+        ), 0) + ?)
         """,
-        [recipe_id, recipe_id],
+        [recipe_id, recipe_id, ORDER_GAP],
     )
     return cursor
 
@@ -407,65 +534,17 @@ def update_ingredients_row(
     return cursor
 
 
-def move_ingredients_row_up(
-    db: Cursor, recipe_id: int, ingredient_id: int
-) -> bool:
-    """Move ingredient up by swapping order_number values
-    with the previous ingredient (in order of appearance).
-    """
-    cursor = db.execute(
-        """
-        UPDATE ingredients SET order_number = CASE
-        WHEN ingredients.id = prev_id THEN this.order_number
-        WHEN ingredients.id = this.id THEN prev_order_number
-        END FROM ingredients AS this, (SELECT id,
-            lag(id) OVER (ORDER BY order_number) AS prev_id,
-            lag(order_number) OVER (ORDER BY order_number) AS prev_order_number
-            FROM ingredients WHERE recipe_id = ?) AS prev
-        WHERE this.id = prev.id
-        AND this.id = ?
-        AND ingredients.id IN (this.id, prev_id);
-        """,
-        [recipe_id, ingredient_id],
-    )
-    return cursor
-
-
-def move_ingredients_row_down(
-    db: Cursor, recipe_id: int, ingredient_id: int
-) -> bool:
-    """Move ingredient down by swapping order_number values
-    with the next ingredient (in order of appearance).
-    """
-    cursor = db.execute(
-        """
-        UPDATE ingredients SET order_number = CASE
-        WHEN ingredients.id = next_id THEN this.order_number
-        WHEN ingredients.id = this.id THEN next_order_number
-        END FROM ingredients AS this, (SELECT id,
-            lead(id) OVER (ORDER BY order_number) AS next_id,
-            lead(order_number) OVER (ORDER BY order_number)
-            AS next_order_number
-            FROM ingredients WHERE recipe_id = ?) AS next
-        WHERE this.id = next.id
-        AND this.id = ?
-        AND ingredients.id IN (this.id, next_id);
-        """,
-        [recipe_id, ingredient_id],
-    )
-    return cursor
-
-
 def add_instructions_row(db: Cursor, recipe_id: int):
-    """Add instructions row to recipe"""
+    """Add instructions row to the end of recipe"""
     cursor = db.execute(
         """
         INSERT INTO instructions (recipe_id, order_number)
-        SELECT ?, IFNULL(MAX(order_number), 0) + 1
-        FROM instructions
-        WHERE recipe_id = ?
+        VALUES (?, IFNULL((
+            SELECT order_number FROM instructions WHERE recipe_id = ?
+            ORDER BY order_number DESC LIMIT 1
+        ), 0) + ?)
         """,
-        [recipe_id, recipe_id],
+        [recipe_id, recipe_id, ORDER_GAP],
     )
     return cursor
 
@@ -503,59 +582,26 @@ def update_instructions_row(
     return cursor
 
 
-def move_instructions_row_up(
-    db: Cursor, recipe_id: int, instruction_id: int
-) -> bool:
-    """Move instruction up by swapping order_number values
-    with the previous instruction (in order of appearance).
-    """
-    cursor = db.execute(
-        """
-        UPDATE instructions SET order_number = CASE
-        WHEN instructions.id = prev_id THEN this.order_number
-        WHEN instructions.id = this.id THEN prev_order_number
-        END FROM instructions AS this, (SELECT id,
-            lag(id) OVER (ORDER BY order_number) AS prev_id,
-            lag(order_number) OVER (ORDER BY order_number) AS prev_order_number
-            FROM instructions WHERE recipe_id = ?) AS prev
-        WHERE this.id = prev.id
-        AND this.id = ?
-        AND instructions.id IN (this.id, prev_id);
-        """,
-        [recipe_id, instruction_id],
-    )
-    return cursor
-
-
-def move_instructions_row_down(
-    db: Cursor, recipe_id: int, instruction_id: int
-) -> bool:
-    """Move instruction down by swapping order_number values
-    with the next instruction (in order of appearance).
+def category_ids(db: Cursor) -> dict[str, int]:
+    """Return the in-process cache of category titles to ids. All
+    categories are read on first use, after that the cache is updated
+    when categories are added or deleted. Entries may be stale if
+    another process changed the categories, so users of the cache must
+    verify the id.
     """
-    cursor = db.execute(
-        """
-        UPDATE instructions SET order_number = CASE
-        WHEN instructions.id = next_id THEN this.order_number
-        WHEN instructions.id = this.id THEN next_order_number
-        END FROM instructions AS this, (SELECT id,
-            lead(id) OVER (ORDER BY order_number) AS next_id,
-            lead(order_number) OVER (ORDER BY order_number)
-            AS next_order_number
-            FROM instructions WHERE recipe_id = ?) AS next
-        WHERE this.id = next.id
-        AND this.id = ?
-        AND instructions.id IN (this.id, next_id);
-        """,
-        [recipe_id, instruction_id],
-    )
-    return cursor
+    ids = current_app.extensions.get("category_ids")
+    if ids is None:
+        ids = dict(db.execute("SELECT title, id FROM categories"))
+        current_app.extensions["category_ids"] = ids
+    return ids
 
 
 def delete_recipe_category(
     db: Cursor, recipe_id: int, category_id: int
 ) -> bool:
-    """Delete category from recipe"""
+    """Delete category from recipe, and the category if no other recipe
+    has it.
+    """
     db.execute(
         """
         DELETE FROM recipe_category
@@ -564,31 +610,57 @@ def delete_recipe_category(
         [recipe_id, category_id],
     )
 
-    db.execute(
+    deleted = db.execute(
         """
         DELETE FROM categories WHERE id = ? AND NOT EXISTS
-        (SELECT 1 FROM recipe_category WHERE category_id = ?);
+        (SELECT 1 FROM recipe_category WHERE category_id = ?)
+        RETURNING title;
         """,
         [category_id, category_id],
-    )
+    ).fetchone()
+    if deleted:
+        category_ids(db).pop(deleted["title"], None)
 
 
 def add_recipe_category(db: Cursor, recipe_id: int, category_name: str):
     """Create the category if it does not exist and add it to the recipe"""
-    db.execute(
+    ids = category_ids(db)
+    category_id = ids.get(category_name)
+    if category_id is not None:
+        # Cached id is used only if it still belongs to the title
+        cursor = db.execute(
+            """
+            INSERT INTO recipe_category (recipe_id, category_id)
+            SELECT ?, id FROM categories WHERE id = ? AND title = ?
+            ON CONFLICT (recipe_id, category_id) DO NOTHING;
+            """,
+            [recipe_id, category_id, category_name],
+        )
+        if cursor.rowcount == 1:
+            return
+        # Nothing inserted: the recipe has the category already, or
+        # the cached id is stale
+        if db.execute(
+            "SELECT 1 FROM categories WHERE id = ? AND title = ?",
+            [category_id, category_name],
+        ).fetchone():
+            return
+        ids.pop(category_name, None)
+
+    row = db.execute(
         """
         INSERT INTO categories (title) VALUES (?)
-        ON CONFLICT (title) DO NOTHING;
-        """,
-        [category_name],
-    )
-
-    category_id = db.execute(
-        """
-        SELECT id FROM categories WHERE title = ?;
+        ON CONFLICT (title) DO NOTHING
+        RETURNING id;
         """,
         [category_name],
-    ).fetchone()["id"]
+    ).fetchone()
+    if row is None:
+        row = db.execute(
+            "SELECT id FROM categories WHERE title = ?", [category_name]
+        ).fetchone()
+    category_id = row["id"]
+    ids[category_name] = category_id
 
     db.execute(
         """
@@ -597,3 +669,117 @@ def add_recipe_category(db: Cursor, recipe_id: int, category_name: str):
         """,
         [recipe_id, category_id],
     )
+
+
+# Ordering of ingredients and instructions rows ##########################
+
+
+def move_rows(
+    db: Cursor, table: str, recipe_id: int, moves: list[tuple[int, str]]
+):
+    """Apply `moves` ie. list of `(row_id, "up" | "down")` to rows of
+    `table`. A single move updates only the moved row, several moves
+    are applied with one `set_rows_order` update.
+    """
+    if len(moves) == 1:
+        move_row(db, table, recipe_id, *moves[0])
+    elif moves:
+        order = [
+            row[0]
+            for row in db.execute(
+                f"""
+                SELECT id FROM {table} WHERE recipe_id = ?
+                ORDER BY order_number, id
+                """,
+                [recipe_id],
+            )
+        ]
+        for row_id, direction in moves:
+            if row_id not in order:
+                continue
+            i = order.index(row_id)
+            j = i - 1 if direction == "up" else i + 1
+            if 0 <= j < len(order):
+                order[i], order[j] = order[j], order[i]
+        set_rows_order(db, table, recipe_id, order)
+
+
+def move_row(
+    db: Cursor, table: str, recipe_id: int, row_id: int, direction: str
+):
+    """Move a row of `table` one step `up` or `down` by setting its
+    `order_number` between the next two rows in that direction.
+    """
+    assert table in ORDERED_TABLES
+    this = db.execute(
+        f"SELECT order_number FROM {table} WHERE recipe_id = ? AND id = ?",
+        [recipe_id, row_id],
+    ).fetchone()
+    if not this:
+        return
+    if direction == "up":
+        sql = f"""
+            SELECT order_number FROM {table} WHERE recipe_id = ?
+            AND (order_number, id) < (?, ?)
+            ORDER BY order_number DESC, id DESC LIMIT 2
+            """
+        step = -ORDER_GAP
+    else:
+        sql = f"""
+            SELECT order_number FROM {table} WHERE recipe_id = ?
+            AND (order_number, id) > (?, ?)
+            ORDER BY order_number, id LIMIT 2
+            """
+        step = ORDER_GAP
+    params = [recipe_id, this["order_number"], row_id]
+    neighbours = [row[0] for row in db.execute(sql, params)]
+    if len(neighbours) == 2 and abs(neighbours[0] - neighbours[1]) < 2:
+        renumber_rows(db, table, recipe_id)
+        this = db.execute(
+            f"SELECT order_number FROM {table} WHERE id = ?", [row_id]
+        ).fetchone()
+        params = [recipe_id, this["order_number"], row_id]
+        neighbours = [row[0] for row in db.execute(sql, params)]
+    if not neighbours:
+        return
+    if len(neighbours) == 1:
+        order_number = neighbours[0] + step
+    else:
+        order_number = (neighbours[0] + neighbours[1]) // 2
+    db.execute(
+        f"UPDATE {table} SET order_number = ? WHERE id = ?",
+        [order_number, row_id],
+    )
+
+
+def set_rows_order(db: Cursor, table: str, recipe_id: int, ids: list[int]):
+    """Set the order of all rows of `table` in one update. The rows are
+    ordered as listed in `ids`, rows not in `ids` are not changed.
+    """
+    assert table in ORDERED_TABLES
+    db.execute(
+        f"""
+        UPDATE {table}
+        SET order_number = (CAST(new_order.key AS INTEGER) + 1) * ?
+        FROM json_each(?) AS new_order
+        WHERE {table}.id = new_order.value AND {table}.recipe_id = ?
+        """,
+        [ORDER_GAP, json.dumps(ids), recipe_id],
+    )
+
+
+def renumber_rows(db: Cursor, table: str, recipe_id: int):
+    """Restore `ORDER_GAP` spacing of rows of `table` in recipe."""
+    assert table in ORDERED_TABLES
+    db.execute(
+        f"""
+        UPDATE {table}
+        SET order_number = ranked.n * ?
+        FROM (
+            SELECT id, row_number() OVER (ORDER BY order_number, id) AS n
+            FROM {table} WHERE recipe_id = ?
+        ) AS ranked
+        WHERE {table}.id = ranked.id
+        """,
+        [ORDER_GAP, recipe_id],
+    )
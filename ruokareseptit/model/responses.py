@@ -0,0 +1,165 @@
+"""Response compression and static asset caching"""
+
+import gzip
+import hashlib
+import os
+import zlib
+from flask import current_app
+from flask import request
+from flask import Response
+
+COMPRESSIBLE_MIMETYPES = ("text/html", "text/css", "text/plain")
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def init_app(app):
+    """Register response handlers. This is called by the application
+    factory.
+    """
+    app.url_defaults(fingerprint_static_url)
+    app.after_request(cache_static_response)
+    app.after_request(compress_response)
+
+
+def static_manifest() -> dict[str, tuple[str, bytes, int, int]]:
+    """Return the static asset manifest of the app, building it on
+    first use. CLI commands never need it.
+    """
+    manifest = current_app.extensions.get("static_manifest")
+    if manifest is None:
+        manifest = build_static_manifest(
+            current_app.static_folder, current_app.config["COMPRESS_LEVEL"]
+        )
+        current_app.extensions["static_manifest"] = manifest
+    return manifest
+
+
+def build_static_manifest(static_folder: str, level: int):
+    """Return a dict of static filename to a manifest entry (see
+    `static_entry`). Built once at startup, so unchanged static files
+    are never hashed or compressed while serving requests.
+    """
+    manifest = {}
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder)
+            filename = filename.replace(os.sep, "/")
+            manifest[filename] = manifest_entry(path, level)
+    return manifest
+
+
+def manifest_entry(path: str, level: int) -> tuple[str, bytes, int, int]:
+    """Return a tuple of content hash, gzip compressed content,
+    modification time and size of the file at `path`.
+    """
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    return (
+        digest,
+        gzip.compress(content, level),
+        stat.st_mtime_ns,
+        stat.st_size,
+    )
+
+
+def static_entry(filename: str) -> tuple[str, bytes, int, int] | None:
+    """Return the manifest entry of static file `filename`, or None if
+    it is not in the manifest. The entry is rebuilt if the file has
+    been modified since, so that a file edited while the app runs gets
+    a new hash and its old compressed content is not served.
+    """
+    manifest = static_manifest()
+    entry = manifest.get(filename)
+    if entry is None:
+        return None
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if (stat.st_mtime_ns, stat.st_size) != entry[2:]:
+        entry = manifest_entry(path, current_app.config["COMPRESS_LEVEL"])
+        manifest[filename] = entry
+    return entry
+
+
+def fingerprint_static_url(endpoint: str, values: dict):
+    """URL defaults callback adding the content hash `v` to the static
+    file URLs, eg. `/static/style.css?v=1234abcd`.
+    """
+    if endpoint == "static" and "filename" in values:
+        entry = static_entry(values["filename"])
+        if entry:
+            values.setdefault("v", entry[0])
+
+
+def cache_static_response(response: Response) -> Response:
+    """Static files requested with the current content hash never change,
+    so they can be cached by the browser without revalidation.
+    """
+    if request.endpoint != "static" or response.status_code != 200:
+        return response
+    entry = static_entry(request.view_args["filename"])
+    if entry and request.args.get("v") == entry[0]:
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def compress_response(response: Response) -> Response:
+    """Gzip compress text responses if the client accepts it. Bodies
+    smaller than `COMPRESS_MIN_SIZE` are sent as is. Streamed responses
+    are compressed chunk by chunk.
+    """
+    if (
+        response.status_code != 200
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    if request.accept_encodings.quality("gzip") <= 0:
+        return response
+
+    level = current_app.config["COMPRESS_LEVEL"]
+    if response.is_streamed and not response.direct_passthrough:
+        response.response = gzip_stream(response.iter_encoded(), level)
+        response.headers.pop("Content-Length", None)
+    elif request.endpoint == "static":
+        # The precompressed content is used only for the current hash,
+        # other versions are compressed from the file that is served
+        entry = static_entry(request.view_args["filename"])
+        response.direct_passthrough = False
+        if entry and request.args.get("v") == entry[0]:
+            data = entry[1]
+        else:
+            data = gzip.compress(response.get_data(), level)
+        response.close()
+        response.set_data(data)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config["COMPRESS_MIN_SIZE"]:
+            return response
+        response.set_data(gzip.compress(data, level))
+
+    response.headers["Content-Encoding"] = "gzip"
+    etag, _ = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def gzip_stream(chunks, level: int):
+    """Compress an iterable of bytes as a gzip stream. Every chunk is
+    flushed, so the client receives it without waiting for the rest.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -1,19 +1,43 @@
 """SQL queries for recipes"""
 
+from dataclasses import dataclass
 from sqlite3 import Cursor
 from flask import current_app
 
+from ruokareseptit.model.archive import restore_review, reviews_source
+from ruokareseptit.model.db import rows_as
+
+
+@dataclass(slots=True, frozen=True)
+class UserReviewListItem:
+    """Row of the list of user's own reviews. `title` and `published`
+    are None if the recipe has been deleted.
+    """
+
+    id: int
+    recipe_id: int | None
+    rating: int | None
+    review: str | None
+    title: str | None
+    published: int | None
+    archived: int
+
 
 # SQL queries for authenticated READ operations ##########################
 
 
-def list_user_reviews(db: Cursor, author_id: int, page: int):
-    """Query reviews of user `author_id`"""
+def list_user_reviews(
+    db: Cursor, author_id: int, page: int, archived: bool = False
+):
+    """Query reviews of user `author_id`, best rated and newest first.
+    Archived reviews are included if `archived` is true.
+    """
+    source = reviews_source(db, archived)
     total_rows = db.execute(
-        """
+        f"""
         SELECT count(*)
-        FROM user_reviews
-        WHERE author_id = ?
+        FROM {source}
+        WHERE user_reviews.author_id = ?
         """,
         [author_id],
     ).fetchone()[0]
@@ -21,19 +45,37 @@ def list_user_reviews(db: Cursor, author_id: int, page: int):
     total_pages = (total_rows - 1) // page_size + 1
     offset = max(min(total_pages - 1, page - 1), 0) * page_size
     user_reviews = db.execute(
-        """
-        SELECT user_reviews.*, recipes.title, recipes.published
-        FROM user_reviews LEFT JOIN recipes
+        f"""
+        SELECT user_reviews.id, user_reviews.recipe_id, user_reviews.rating,
+        user_reviews.review, recipes.title, recipes.published,
+        user_reviews.archived
+        FROM {source} LEFT JOIN recipes
         ON user_reviews.recipe_id = recipes.id
         WHERE user_reviews.author_id = ?
-        ORDER BY user_reviews.rating DESC
+        ORDER BY user_reviews.rating DESC, user_reviews.created_at DESC,
+        user_reviews.id DESC
         LIMIT ? OFFSET ?
         """,
         [author_id, page_size, offset],
     )
+    user_reviews.row_factory = rows_as(UserReviewListItem)
     return user_reviews, total_rows, total_pages
 
 
+def fetch_author_review_id(db: Cursor, recipe_id: int, author_id: int):
+    """Return id of the review of user `author_id` for `recipe_id`, or
+    None if the user has not reviewed the recipe.
+    """
+    row = db.execute(
+        """
+        SELECT id FROM user_reviews
+        WHERE author_id = ? AND recipe_id = ?
+        """,
+        [author_id, recipe_id],
+    ).fetchone()
+    return row[0] if row else None
+
+
 def fetch_author_review_context(db: Cursor, recipe_id: int, author_id: int):
     """Fetch a review from database. The review `author_id` in
     databse must match the `author_id` passed. Returns a dict
@@ -59,17 +101,23 @@ def fetch_author_review_context(db: Cursor, recipe_id: int, author_id: int):
 
 
 def insert_review(db: Cursor, author_id: int, recipe_id: int):
-    """Insert new review to database. Fields must include keys
-    `title`, `summary` and `author_id`.
+    """Insert new review to database, unless the user has already
+    reviewed the recipe. An archived review of the user is moved back
+    to the hot table first. Returns the id of the review.
     """
-    cursor = db.execute(
+    restore_review(db, author_id, recipe_id)
+    # The no-op update makes RETURNING return the existing row
+    review_id: int = db.execute(
         """
         INSERT INTO user_reviews (author_id, recipe_id)
         VALUES (?, ?)
+        ON CONFLICT (author_id, recipe_id)
+        DO UPDATE SET author_id = excluded.author_id
+        RETURNING id
         """,
         [author_id, recipe_id],
-    )
-    return cursor
+    ).fetchone()[0]
+    return review_id
 
 
 def update_author_review(
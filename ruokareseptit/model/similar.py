@@ -0,0 +1,279 @@
+"""Precomputed similar recipes
+
+`flask similar-recipes` computes the most similar published recipes of
+every published recipe and stores them in `recipe_neighbors`. Similarity
+is the sum of
+
+* IDF weighted Jaccard similarity of the ingredient titles and
+  categories of the recipes, and
+* cosine similarity of the sets of users who rated the recipes highly
+  (co-rating), weighted by `CO_RATING_WEIGHT`.
+
+Candidates of a recipe are found through an inverted index from features
+(ingredients, categories and users) to recipes, so only recipes sharing
+at least one feature are compared. Features shared by more than
+`max_df` recipes would make the comparisons quadratic and carry little
+information, so they are left out of the index.
+"""
+
+import heapq
+import math
+import sqlite3
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+import click
+from flask import current_app
+
+from ruokareseptit.model.db import get_db
+
+CO_RATING_WEIGHT = 0.5
+LIKED_RATING = 4
+
+
+def fetch_similar_recipes(db: sqlite3.Connection, recipe_id: int):
+    """Query published similar recipes of `recipe_id`, most similar
+    first.
+    """
+    similar_limit = current_app.config["SIMILAR_RECIPES_MAX"]
+    return db.execute(
+        """
+        SELECT recipes.id, recipes.title
+        FROM recipe_neighbors JOIN recipes
+        ON recipe_neighbors.neighbor_id = recipes.id
+        WHERE recipe_neighbors.recipe_id = ? AND published = 1
+        ORDER BY recipe_neighbors.score DESC
+        LIMIT ?
+        """,
+        [recipe_id, similar_limit],
+    )
+
+
+def read_content_features(db: sqlite3.Connection):
+    """Return a dict of published recipe id to a set of its features,
+    ie. case folded ingredient titles and category ids.
+    """
+    features = defaultdict(set)
+    for recipe_id in db.execute("SELECT id FROM recipes WHERE published = 1"):
+        features[recipe_id[0]] = set()
+    rows = db.execute(
+        """
+        SELECT ingredients.recipe_id, ingredients.title
+        FROM ingredients JOIN recipes ON ingredients.recipe_id = recipes.id
+        WHERE recipes.published = 1 AND ingredients.title IS NOT NULL
+        """
+    )
+    for recipe_id, title in rows:
+        title = " ".join(title.casefold().split())
+        if title:
+            features[recipe_id].add(("ingredient", title))
+    rows = db.execute(
+        """
+        SELECT recipe_category.recipe_id, recipe_category.category_id
+        FROM recipe_category JOIN recipes
+        ON recipe_category.recipe_id = recipes.id
+        WHERE recipes.published = 1
+        """
+    )
+    for recipe_id, category_id in rows:
+        features[recipe_id].add(("category", category_id))
+    return features
+
+
+def read_likes(db: sqlite3.Connection):
+    """Return a dict of published recipe id to a set of ids of users
+    who rated it highly.
+    """
+    likes = defaultdict(set)
+    rows = db.execute(
+        """
+        SELECT user_reviews.recipe_id, user_reviews.author_id
+        FROM user_reviews JOIN recipes
+        ON user_reviews.recipe_id = recipes.id
+        WHERE recipes.published = 1
+        AND user_reviews.author_id IS NOT NULL
+        AND user_reviews.rating >= ?
+        """,
+        [LIKED_RATING],
+    )
+    for recipe_id, author_id in rows:
+        likes[recipe_id].add(author_id)
+    return likes
+
+
+def inverted_index(sets: dict, max_df: int):
+    """Return a dict of feature to list of keys of `sets` containing
+    it. Features contained by more than `max_df` sets are left out.
+    """
+    index = defaultdict(list)
+    for key, features in sets.items():
+        for feature in features:
+            index[feature].append(key)
+    return {f: keys for f, keys in index.items() if len(keys) <= max_df}
+
+
+def content_scores(recipe_id, features, index, weights, totals):
+    """Return a dict of candidate recipe id to IDF weighted Jaccard
+    similarity with `recipe_id`.
+    """
+    common = defaultdict(float)
+    for feature in features[recipe_id]:
+        weight = weights.get(feature)
+        if weight is None:
+            continue
+        for other in index[feature]:
+            common[other] += weight
+    common.pop(recipe_id, None)
+    total = totals[recipe_id]
+    return {
+        other: shared / (total + totals[other] - shared)
+        for other, shared in common.items()
+    }
+
+
+def co_rating_scores(recipe_id, likes, index):
+    """Return a dict of candidate recipe id to cosine similarity of
+    the users who liked them and `recipe_id`.
+    """
+    common = defaultdict(int)
+    for user in likes.get(recipe_id, ()):
+        for other in index.get(user, ()):
+            common[other] += 1
+    common.pop(recipe_id, None)
+    count = len(likes[recipe_id]) if common else 0
+    return {
+        other: shared / math.sqrt(count * len(likes[other]))
+        for other, shared in common.items()
+    }
+
+
+@dataclass(slots=True, frozen=True)
+class Similarity:
+    """Features and likes of the published recipes with their inverted
+    indexes, IDF weights of the features and the weight totals of
+    each recipe.
+    """
+
+    features: dict
+    likes: dict
+    feature_index: dict
+    like_index: dict
+    weights: dict
+    totals: dict
+
+    def nearest(self, recipe_id: int, top: int):
+        """Return a list of the `top` most similar recipes of
+        `recipe_id` as tuples of recipe id and score.
+        """
+        scores = content_scores(
+            recipe_id,
+            self.features,
+            self.feature_index,
+            self.weights,
+            self.totals,
+        )
+        for other, score in co_rating_scores(
+            recipe_id, self.likes, self.like_index
+        ).items():
+            scores[other] = scores.get(other, 0.0) + (
+                CO_RATING_WEIGHT * score
+            )
+        return heapq.nlargest(top, scores.items(), key=lambda s: s[1])
+
+
+def read_similarity(db: sqlite3.Connection, max_df: int) -> Similarity:
+    """Read the features and likes of the published recipes and index
+    them. Features of more than `max_df` recipes are left out.
+    """
+    features = read_content_features(db)
+    likes = read_likes(db)
+    feature_index = inverted_index(features, max_df)
+    count = max(len(features), 1)
+    weights = {
+        feature: math.log(count / len(recipes)) + 1.0
+        for feature, recipes in feature_index.items()
+    }
+    totals = {
+        recipe_id: sum(weights.get(f, 0.0) for f in recipe_features)
+        for recipe_id, recipe_features in features.items()
+    }
+    return Similarity(
+        features,
+        likes,
+        feature_index,
+        inverted_index(likes, max_df),
+        weights,
+        totals,
+    )
+
+
+def compute_similar_recipes(
+    db: sqlite3.Connection,
+    top: int,
+    max_df: int,
+    chunk_size: int = 1000,
+    echo=print,
+) -> int:
+    """Replace `recipe_neighbors` with the `top` most similar recipes
+    of each published recipe. Recipes are written in chunks of
+    `chunk_size` ids, each chunk in a transaction of its own, so that
+    the write lock is not held for the whole run. Returns the number of
+    rows written.
+    """
+    similarity = read_similarity(db, max_df)
+    echo(
+        f"{len(similarity.features)} recipes, "
+        f"{len(similarity.feature_index)} content and "
+        f"{len(similarity.like_index)} user features."
+    )
+
+    max_id = db.execute(
+        "SELECT IFNULL(MAX(id), 0) FROM recipes"
+    ).fetchone()[0]
+    written = 0
+    for start in range(0, max_id, chunk_size):
+        end = start + chunk_size
+        rows = [
+            (recipe_id, other, score)
+            for recipe_id in range(start + 1, end + 1)
+            if recipe_id in similarity.features
+            for other, score in similarity.nearest(recipe_id, top)
+        ]
+        with db:
+            db.execute(
+                """
+                DELETE FROM recipe_neighbors
+                WHERE recipe_id > ? AND recipe_id <= ?
+                """,
+                [start, end],
+            )
+            db.executemany(
+                """
+                INSERT INTO recipe_neighbors (recipe_id, neighbor_id, score)
+                VALUES (?, ?, ?)
+                """,
+                rows,
+            )
+        written += len(rows)
+        echo(f"  {min(end, max_id)}/{max_id}")
+    return written
+
+
+@click.command("similar-recipes")
+@click.option("--top", type=int, help="Neighbors stored per recipe.")
+@click.option(
+    "--max-df",
+    type=int,
+    default=500,
+    show_default=True,
+    help="Ignore features shared by more recipes than this.",
+)
+def similar_recipes_command(top: int | None, max_df: int):
+    """Compute similar recipes of every published recipe."""
+    started = time.perf_counter()
+    top = top or current_app.config["SIMILAR_RECIPES_MAX"]
+    written = compute_similar_recipes(get_db(), top, max_df, echo=click.echo)
+    click.echo(
+        f"Stored {written} similar recipes "
+        f"in {time.perf_counter() - started:.1f} s."
+    )
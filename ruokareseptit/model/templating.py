@@ -0,0 +1,108 @@
+"""Template compilation cache and utilities"""
+
+import os
+from sqlite3 import Connection
+import click
+from flask import current_app
+from flask import g
+from flask import get_flashed_messages
+from flask import render_template
+from flask import stream_template
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from ruokareseptit.model.recipes import fetch_published_recipe
+from ruokareseptit.model.recipes import fetch_published_recipe_context
+
+# Number of template output fragments joined into one streamed chunk
+STREAM_BUFFER_SIZE = 64
+
+
+def init_app(app):
+    """Store compiled templates as bytecode under the instance folder,
+    so that new worker processes do not have to compile them again.
+    Template auto reload follows Flask's default and is enabled only
+    in debug mode. This is called by the application factory.
+    """
+    cache_dir = os.path.join(app.instance_path, "jinja_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_options = {
+        **app.jinja_options,
+        "bytecode_cache": FileSystemBytecodeCache(cache_dir),
+    }
+    app.cli.add_command(precompile_templates_command)
+
+
+def precompile_templates() -> list[str]:
+    """Compile all templates of the app and its blueprints. Returns
+    the list of template names.
+    """
+    env = current_app.jinja_env
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+def recipe_page_context(db: Connection, recipe_id: int, archived=False):
+    """Fetch a published recipe with `fetch_published_recipe_context`.
+    The content below the recipe header is rendered to `recipe_body`
+    from `recipes/common/recipe_body.html`, and cached by recipe id
+    and `content_version`. A cached body saves reading the related
+    rows. Returns None if the recipe is not published.
+    """
+    recipe_row = fetch_published_recipe(db, recipe_id)
+    if recipe_row is None:
+        return None
+
+    fragment_cache = current_app.extensions["fragment_cache"]
+    body_key = ("recipe_body", recipe_id, recipe_row["content_version"])
+    recipe_body = fragment_cache.get(body_key)
+    context = fetch_published_recipe_context(
+        db, recipe_row, archived, content=recipe_body is None
+    )
+    if recipe_body is None:
+        recipe_body = Markup(
+            render_template("recipes/common/recipe_body.html", **context)
+        )
+        fragment_cache.set(body_key, recipe_body)
+    return {**context, "recipe_body": recipe_body}
+
+
+def stream_page(template_name: str, **context):
+    """Render template as a stream, so that the beginning of the page
+    is sent before the rest of the template (eg. rows of a lazily read
+    cursor) has been rendered. Flashed messages are consumed before the
+    response headers are sent, so the session cookie is updated. The
+    database connection is detached from the request and closed only
+    after the whole page has been sent.
+    """
+    get_flashed_messages()
+    db = g.pop("db", None)
+    return buffered(stream_template(template_name, **context), db)
+
+
+def buffered(chunks, db: Connection | None = None):
+    """Join every `STREAM_BUFFER_SIZE` template fragments into one
+    chunk to avoid writing each small fragment separately. Closes
+    `db` when done.
+    """
+    try:
+        buffer = []
+        for chunk in chunks:
+            buffer.append(chunk)
+            if len(buffer) >= STREAM_BUFFER_SIZE:
+                yield "".join(buffer)
+                buffer = []
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if db:
+            db.close()
+
+
+@click.command("precompile-templates")
+def precompile_templates_command():
+    """Compile all templates to the bytecode cache."""
+    names = precompile_templates()
+    click.echo(f"Compiled {len(names)} templates.")
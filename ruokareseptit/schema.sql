@@ -1,6 +1,14 @@
 -- Initialize the database.
 -- Use `flask --app ruokareseptit init-db` to execute this script.
 
+-- Streamed pages keep a read transaction open while the page is sent.
+-- In WAL mode readers do not block writers (and vice versa).
+PRAGMA journal_mode = WAL;
+
+-- Free pages are returned to the file system by `flask maintenance`.
+-- The VACUUM at the end applies this to an existing database.
+PRAGMA auto_vacuum = INCREMENTAL;
+
 PRAGMA foreign_keys = OFF;
 DROP TABLE IF EXISTS recipes;
 DROP TABLE IF EXISTS users;
@@ -9,7 +17,13 @@ DROP TABLE IF EXISTS instructions;
 DROP TABLE IF EXISTS categories;
 DROP TABLE IF EXISTS recipe_category;
 DROP TABLE IF EXISTS user_reviews;
+DROP TABLE IF EXISTS migration_progress;
+DROP TABLE IF EXISTS recipe_neighbors;
 PRAGMA foreign_keys = ON;
+-- This script creates the schema version 0. Changes after that are
+-- versioned migrations in `model/migrations.py`, applied by `init-db`
+-- and `migrate` commands.
+PRAGMA user_version = 0;
 
 CREATE TABLE users (
   id INTEGER PRIMARY KEY,
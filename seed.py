@@ -117,7 +117,7 @@ def add_user_review(user_id, recipe_id):
     db.execute(
         """
         INSERT INTO user_reviews (author_id, recipe_id, rating, review)
-        VALUES (?,?,?,?)
+        VALUES (?,?,?,?) ON CONFLICT DO NOTHING
         """, [user_id, recipe_id, rating, review])
 
 def main():
@@ -170,7 +170,7 @@ def main():
             db.execute(
                 """
                 INSERT INTO user_reviews (author_id, recipe_id, rating)
-                VALUES (?,?,?)
+                VALUES (?,?,?) ON CONFLICT DO NOTHING
                 """, [user_id, recipe_id, rating])
 
     print("Commit and vacuum...")
@@ -0,0 +1,90 @@
+"""Measure startup time of the application against a budget
+
+Every measurement runs in a new Python process, like the web workers and
+CLI commands do. Run from the project root:
+
+    python3 startup_budget.py
+
+Exits with status 1 if the median of any measurement is over its budget.
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+RUNS = 5
+
+# Milliseconds
+BUDGET = {
+    "import": 250,  # import ruokareseptit, mostly Flask itself
+    "create_app": 30,  # create_app() with the views, as run by CLI commands
+    "first_request": 40,  # first GET /recipes/
+}
+
+MEASURE = """
+import json, time
+started = time.perf_counter()
+import ruokareseptit
+imported = time.perf_counter()
+app = ruokareseptit.create_app()
+created = time.perf_counter()
+app.test_client().get("/recipes/").get_data()
+requested = time.perf_counter()
+print(json.dumps({
+    "import": (imported - started) * 1000,
+    "create_app": (created - imported) * 1000,
+    "first_request": (requested - created) * 1000,
+}))
+"""
+
+
+def measure() -> dict[str, float]:
+    """Run the measurement in a new process."""
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def slowest_imports(count: int = 10) -> list[tuple[int, str]]:
+    """Return the `count` slowest imports with their cumulative import
+    time in microseconds, from `-X importtime`.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", MEASURE],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            imports.append((int(cumulative), name.strip()))
+    imports.sort(reverse=True)
+    return imports[:count]
+
+
+def main():
+    """Measure and compare to the budget"""
+    runs = [measure() for _ in range(RUNS)]
+    over_budget = False
+    for name, budget in BUDGET.items():
+        median = statistics.median(run[name] for run in runs)
+        status = "ok" if median <= budget else "OVER BUDGET"
+        over_budget = over_budget or median > budget
+        print(f"{name:15} {median:7.1f} ms  (budget {budget} ms) {status}")
+
+    print("\nSlowest imports (cumulative):")
+    for cumulative, name in slowest_imports():
+        print(f"{cumulative / 1000:7.1f} ms  {name}")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()